@@ -11,8 +11,6 @@ import concurrent.futures
 from enum import Enum
 from typing import NamedTuple
 from types import SimpleNamespace
-from canvasapi import Canvas
-from canvasapi import exceptions
 from datetime import datetime
 from datetime import timedelta
 from datetime import date as datetime_date
@@ -30,7 +28,7 @@ class Comment:
 class Assignment:
     comments_loaded = 0
 
-    def __init__(self, user, course_name, raw_assignment):
+    def __init__(self, user, course_name, raw_assignment, comment_loader=None):
         self.logger = logging.getLogger(__name__)
         self.user = user
         self.course_name = course_name
@@ -38,27 +36,66 @@ class Assignment:
         self.id = self.assignment.id
         self.course_id = self.assignment.course_id
         self.submission = self.assignment.submission
-        self.submission_date = None
+        self.comment_loader = comment_loader
         self.have_loaded_submission_comments = False
-        self.submission_comments = []
-        self.due_date = None
+        self._submission_comments = []
         self.status = SubmissionStatus.Not_Submitted
-        self.attempts = self.submission.attempt
         self.possible_gain = 0
+        if hasattr(self.submission, "submission_comments"):
+            self.set_submission_comments(self.submission.submission_comments)
+        self.refresh()
+        if not self.is_valid:
+            self.logger.warn("Invalid assignment: {} {} {} {}".format(self.course_name, self.assignment.name, self.assignment.points_possible, self.submission.excused))
+
+    # Derived state, recomputed whenever the raw assignment or submission changes
+    def refresh(self):
+        self.submission_date = None
+        self.attempts = self.submission.attempt
+        self.due_date = None
         if self.assignment.due_at is not None:
             self.due_date = utils.convert_date(self.assignment.due_at)
         elif self.assignment.lock_at is not None:
             self.due_date = utils.convert_date(self.assignment.lock_at)
         self.group = self.assignment.assignment_group_id
-        for comment in self.submission.submission_comments:
-            self.submission_comments.append(Comment(comment))
         self.is_valid = self.assignment.points_possible is not None \
                         and self.assignment.points_possible > 0 \
                         and self.due_date is not None \
-                        and not self.submission.excused \
-
-        if not self.is_valid:
-            self.logger.warn("Invalid assignment: {} {} {} {}".format(self.course_name, self.assignment.name, self.assignment.points_possible, self.submission.excused))
+                        and not self.submission.excused
+
+    def update_assignment(self, fields):
+        for name, value in fields.items():
+            setattr(self.assignment, name, value)
+        self.refresh()
+
+    def update_submission(self, fields):
+        for name, value in fields.items():
+            setattr(self.submission, name, value)
+        self.refresh()
+
+    # Comments not loaded yet will include this one when they are fetched
+    def add_comment(self, comment):
+        if self.have_loaded_submission_comments:
+            self._submission_comments.append(Comment(comment))
+            self._submission_comments.sort(key=lambda c: c.date)
+
+    # Comments are fetched on first use unless the course has already batch loaded them
+    @property
+    def submission_comments(self):
+        if not self.have_loaded_submission_comments and self.comment_loader:
+            self.comment_loader(self)
+        return self._submission_comments
+
+    def set_submission_comments(self, comments):
+        self._submission_comments = [Comment(comment) for comment in comments]
+        self.have_loaded_submission_comments = True
+        Assignment.comments_loaded += 1
+
+    # Comments are only read by the Has_Comment check (anything not fully scored) and to
+    # recover manual "Submitted mm/dd" dates (no submitted_at), so only those are prefetched
+    def may_need_comments(self, date):
+        if not self.is_valid or self.due_date > date:
+            return False
+        return self.submission.submitted_at is None or self.get_score() < 100
 
     def get_course_name(self):
         return self.course_name
@@ -203,5 +240,8 @@ class AssignmentStatus():
         self.dropped = assignment.get_points_dropped()
         self.possible_gain = assignment.possible_gain
         self.attempts = assignment.get_attempts()
-        self.submission_comments = assignment.submission_comments
+
+    @property
+    def submission_comments(self):
+        return self.a.submission_comments
 
@@ -0,0 +1,167 @@
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime
+import pytz
+import synthetic
+import utils
+
+# Times the CPU side of the reports on synthetic students, with no network:
+#
+#   construct  Course.ingest, building Assignment objects from raw assignments and submissions
+#   update     WeightedScoreCalculator.update over every assignment
+#   gain       WeightedScoreCalculator.gain for every valid assignment
+#   classify   Reporter.check_course_assignments, the missing/low score/being marked/comment report
+#   render     rendering the /all tables from the report rows (needs Flask)
+#
+#   python benchmark.py --sizes 100 1000 10000 100000 --save
+#   python benchmark.py --compare
+
+STAGES = ["construct", "update", "gain", "classify", "render"]
+
+def default_baseline():
+    return utils.cache_path("benchmarks", "baseline.json")
+
+
+def time_construct(student, reporter, now):
+    synthetic.ingest(student)
+
+def time_update(student, reporter, now):
+    reporter.calculator.update(reporter.assignments, now)
+
+def time_gain(student, reporter, now):
+    for assignment in reporter.assignments.values():
+        if reporter.calculator.includes_assignment(assignment):
+            reporter.calculator.gain(assignment)
+
+def time_classify(student, reporter, now):
+    reporter.check_course_assignments(now)
+
+# Rows built outside the timed call so only rendering is measured, with the fragment
+# cache emptied each time so every table is rendered
+def prepare_render(student, reporter, now):
+    import flask_app
+    from snapshot import assignment_row
+    from assignment import SubmissionStatus
+    report = reporter.check_course_assignments(now)
+    def rows(status):
+        return tuple(assignment_row(a) for a in report if a.status == status)
+    sections = {
+        "scores":       tuple(reporter.get_course_scores()),
+        "today":        (),
+        "week":         tuple(assignment_row(a) for a in report),
+        "missing":      rows(SubmissionStatus.Missing),
+        "low_score":    rows(SubmissionStatus.Low_Score),
+        "being_marked": rows(SubmissionStatus.Being_Marked),
+        "has_comment":  rows(SubmissionStatus.Has_Comment),
+        "service":      (0,)
+    }
+    def render():
+        flask_app.fragments.fragments.clear()
+        with flask_app.app.test_request_context("/all"):
+            flask_app.render_sections("synthetic", sections, 0)
+    return render
+
+timers = {
+    "construct": time_construct,
+    "update":    time_update,
+    "gain":      time_gain,
+    "classify":  time_classify
+}
+
+# Best of repeat runs, in seconds
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(sizes, stages, repeat, seed):
+    now = datetime.now(pytz.UTC)
+    results = {}
+    for size in sizes:
+        student = synthetic.synthetic_student(size, seed=seed, now=now)
+        reporter = synthetic.synthetic_reporter(student)
+        results[str(size)] = {}
+        for stage in stages:
+            if stage == "render":
+                try:
+                    fn = prepare_render(student, reporter, now)
+                except ImportError as e:
+                    print("Skipping render: {}".format(e))
+                    stages = [s for s in stages if s != "render"]
+                    continue
+            else:
+                fn = lambda timer=timers[stage]: timer(student, reporter, now)
+            results[str(size)][stage] = best_time(fn, repeat)
+    return results
+
+# Growth exponent between consecutive sizes, 1.0 is linear
+def exponents(results, stage):
+    sizes = sorted(int(size) for size in results if stage in results[size])
+    slopes = []
+    for small, large in zip(sizes, sizes[1:]):
+        t0, t1 = results[str(small)][stage], results[str(large)][stage]
+        slopes.append(math.log(t1 / t0) / math.log(large / small) if t0 > 0 and t1 > 0 else None)
+    return slopes
+
+def print_results(results, stages, baseline=None, threshold=0.1):
+    sizes = sorted(results, key=int)
+    print("%-10s %10s %12s %12s %10s" % ("stage", "size", "total ms", "us/item", "vs base"))
+    for stage in stages:
+        for size in sizes:
+            if stage not in results[size]:
+                continue
+            seconds = results[size][stage]
+            compare = ""
+            if baseline and stage in baseline.get(size, {}):
+                ratio = seconds / baseline[size][stage]
+                compare = "%+.0f%%" % (100 * (ratio - 1))
+                if ratio > 1 + threshold:
+                    compare += " SLOWER"
+                elif ratio < 1 - threshold:
+                    compare += " faster"
+            print("%-10s %10s %12.2f %12.3f %10s" % (stage, size, 1000 * seconds, 1e6 * seconds / int(size), compare))
+        slopes = [("%.2f" % s) if s is not None else "-" for s in exponents(results, stage)]
+        if slopes:
+            print("%-10s scaling exponents %s" % (stage, " ".join(slopes)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time the reports on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000], help='assignments per student')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=None, help='baseline JSON file (default in the cache directory)')
+    parser.add_argument('--save', action='store_true', help='save these results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare against the baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as slower or faster')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Configured before flask_app is imported so its default does not apply, and above
+    # WARNING so the invalid synthetic assignments are not logged one by one
+    logging.basicConfig(level=logging.ERROR)
+    path = args.baseline if args.baseline else default_baseline()
+    baseline = None
+    if args.compare:
+        if os.path.exists(path):
+            with open(path) as json_file:
+                baseline = json.load(json_file)["results"]
+        else:
+            print("No baseline at {}".format(path))
+    results = run(args.sizes, args.stages, args.repeat, args.seed)
+    print_results(results, args.stages, baseline, args.threshold)
+    if args.save:
+        with open(path, "w") as json_file:
+            json.dump({"taken_at": time.time(), "seed": args.seed, "repeat": args.repeat, "results": results}, json_file, indent=2)
+        print("Saved baseline to {}".format(path))
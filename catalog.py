@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import NamedTuple
+
+# Which courses are graded, honors or service, and which assignment groups count, per Canvas
+# instance. catalog.json maps each instance URL to its entry; keys an entry leaves out come
+# from "default". Each list of names is compiled once into a single pattern matching any of
+# them anywhere in a course or group name, and results are cached by course and group id.
+
+CATALOG_FILE = os.environ.get("CCANVAS_CATALOG", "catalog.json")
+
+
+class CourseClass(NamedTuple):
+    name: str
+    is_valid: bool
+    is_honors: bool
+    is_service: bool
+
+
+# Longest names first, so a code that extends another is the one matched
+def compile_names(names):
+    if not names:
+        return None
+    return re.compile("|".join(re.escape(name) for name in sorted(set(names), key=len, reverse=True)))
+
+def matches(pattern, text):
+    return pattern is not None and pattern.search(text) is not None
+
+
+class Catalog:
+    def __init__(self, entry):
+        self.courses = compile_names(entry.get("courses"))
+        self.honors = compile_names(entry.get("honors"))
+        self.service = compile_names(entry.get("service"))
+        self.excluded_groups = compile_names(entry.get("excluded_groups"))
+        self.course_classes = {}
+        self.excluded = {}
+
+    def classify_course(self, id, name):
+        found = self.course_classes.get(id)
+        if found is None:
+            code = self.courses.search(name) if self.courses is not None else None
+            is_service = matches(self.service, name)
+            short_name = "Service" if is_service else code.group(0) if code else name
+            found = self.course_classes[id] = CourseClass(short_name, code is not None, matches(self.honors, name), is_service)
+        return found
+
+    def is_excluded_group(self, group):
+        excluded = self.excluded.get(group.id)
+        if excluded is None:
+            excluded = self.excluded[group.id] = matches(self.excluded_groups, group.name)
+        return excluded
+
+    # Groups that count towards the course weightings
+    def filter_groups(self, groups):
+        return [group for group in groups if not self.is_excluded_group(group)]
+
+    def stats(self):
+        return {"courses": len(self.course_classes), "groups": len(self.excluded)}
+
+
+class Catalogs:
+    def __init__(self, file_name=CATALOG_FILE):
+        self.logger = logging.getLogger(__name__)
+        self.file_name = file_name
+        self.entries = None
+        self.catalogs = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.entries is None:
+            if os.path.exists(self.file_name):
+                with open(self.file_name) as json_file:
+                    self.entries = json.load(json_file)
+            else:
+                self.logger.warning("No course catalog in {}, no course is graded".format(self.file_name))
+                self.entries = {}
+        return self.entries
+
+    # The compiled catalog of the Canvas instance at url, the default one for None
+    def get(self, url=None):
+        key = url.rstrip("/") if url else None
+        with self.lock:
+            catalog = self.catalogs.get(key)
+            if catalog is None:
+                entries = self.load()
+                if key is not None and key not in entries:
+                    self.logger.warning("No entry for {} in {}, no course there is graded".format(key, self.file_name))
+                catalog = self.catalogs[key] = Catalog({**entries.get("default", {}), **entries.get(key, {})})
+            return catalog
+
+    # A catalog for courses defined in code (e.g. synthetic.py), with the default rules for the rest
+    def build(self, entry):
+        with self.lock:
+            return Catalog({**self.load().get("default", {}), **entry})
+
+    def stats(self):
+        with self.lock:
+            return {url or "default": catalog.stats() for url, catalog in self.catalogs.items()}
+
+
+catalogs = Catalogs()
@@ -2,10 +2,18 @@ import sys
 import argparse
 import json
 from datetime import datetime
-from reporter import Reporter
-from assignment import SubmissionStatus
 import logging
 
+# Courses whose assignments each report reads, so only those are fetched. Grades come from
+# the course list except where a course hides its final grade. Reports not listed need
+# every course.
+report_courses = {
+    "grades":  lambda course: course.is_valid and not course.has_grade,
+    "service": lambda course: course.is_service,
+    "history": lambda course: False,
+    "announcements": lambda course: False
+}
+
 def mm_dd(date):
     if (date):
         return date.strftime("%m/%d")
@@ -27,88 +35,151 @@ def parse_args(config):
     parser.add_argument('--all', action="store_true", help='check for missing assignments')
     parser.add_argument('--grades', action="store_true", help='list course scores')
     parser.add_argument('--service', action="store_true", help='remaining christian service hours')
+    parser.add_argument('--history', action="store_true", help='grades for every term and cumulative GPA')
     parser.add_argument('--submissions', action="store_true", help='create submission time report')
     parser.add_argument('--announcements', action="store_true", help='list announcements')
+    parser.add_argument('--search', type=str, default=None, help='search teacher comments for the given words')
+    parser.add_argument('--warm', action="store_true", help='report from the last saved state when it is recent enough')
+    parser.add_argument('--max-age', type=int, default=15, help='minutes a saved state stays usable with --warm')
+    parser.add_argument('--trace', action="store_true", help='record a trace of the run as JSON in the cache directory')
     parser.add_argument('--loglevel', choices={'debug', 'info', 'warning', 'error', 'critical'}, default='error', help="Set the logging level")
     return parser.parse_args()
 
+def selected_report(args):
+    for report in ["grades", "low", "missing", "being_marked", "has_comment", "calendar", "service", "history", "announcements", "search", "all"]:
+        if getattr(args, report):
+            return report
+    return "today"
+
 with open('config.json') as json_file:
     config = json.load(json_file)
 
 args = parse_args(config) 
 # print(args)
 logging.basicConfig(level=logging.getLevelName(args.loglevel.upper()))
-reporter = Reporter(config[args.student], args.term)
-reporter.load_assignments()
 
-if args.grades:
-    print("\n==== Grades ====")
-    scores = reporter.get_course_scores()
-    for score in scores:
-        print("%-10s: %3d %1.2f %1.2f" % (score.course, score.score, score.wpoints, score.upoints))
-elif args.low:
-    print("\n==== Assignments with low score ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Low_Score, args.min)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %s %s %d [%d%%]" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), mm_dd(status.graded_date), status.attempts, status.possible_gain))
-        assignment = reporter.get_assignment(status.id)
-        for comment in assignment.submission_comments:
-            print("%s %s %s" % (comment.author, mm_dd(comment.date), comment.text))
-elif args.missing:
-    print("\n==== Missing assignments ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Missing, 1)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
-        assignment = reporter.get_assignment(status.id)
-        for comment in status.submission_comments:
-            print("  - %s %s %s" % (comment.author, mm_dd(comment.date), comment.text))
-elif args.being_marked:
-    print("\n==== Assignments Being Marked ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Being_Marked, args.min)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %s %d" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), status.possible_gain))
-elif args.has_comment:
-    print("\n==== Assignments Being Marked ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Has_Comment, args.min)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %s %d" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), status.possible_gain))
-elif args.calendar:
-    status_list = reporter.run_calendar_report(datetime.today())
-    for status in status_list:
-        print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
-elif args.service:
-    print("%1.1f hours of service still to do" % (reporter.get_remaining_service_hours()))
-elif args.all:
-    print("\n=== To-day ====")
-    status_list = reporter.run_daily_submission_report(args.date)
-    for status in status_list:
-        state = status.status.name + " (%d%%)" % (status.score) if status.status == SubmissionStatus.Marked else status.status.name
-        print("%-10s: %-25.25s [%-10.10s] %d" % (status.course, status.name, state, status.possible_gain))
-    print("\n=== This week ====")
-    status_list = reporter.run_calendar_report(args.date)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
-    print("\n==== Missing assignments ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Missing, args.min)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
-    print("\n==== Assignments with low score ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Low_Score, args.min)
-    for status in status_list[0:15]:
-        print("%-10s: %-25.25s %s [%d]" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
-    print("\n==== Assignments Being Marked ====")
-    status_list = reporter.run_assignment_report(SubmissionStatus.Being_Marked, args.min)
-    for status in status_list:
-        print("%-10s: %-25.25s %s %s %d" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), status.possible_gain))
-    print("\n==== Grades ====")
-    scores = reporter.get_course_scores()
-    for score in scores:
-        print("%-10s: %3d %1.2f %1.2f" % (score.course, score.score, score.upoints, score.wpoints))
-else:
-    status_list = reporter.run_daily_submission_report(args.date)
-    print("\n=== Assignments due on %s ====" % (mm_dd(args.date)))
-    for status in status_list:
-        state = status.status.name + " (%d%%)" % (status.score) if status.status == SubmissionStatus.Marked else status.status.name
-        print("%-10s: %-25.25s [%-10.10s] %d" % (status.course, status.name, state, status.possible_gain))
+# Deferred until the arguments are known to be good, canvasapi and pytz are slow to import
+from reporter import Reporter
+from assignment import SubmissionStatus
+
+import tracing
+import utils
 
+def load_reporter():
+    include = report_courses.get(selected_report(args))
+    reporter = None
+    if args.warm:
+        import warmstart
+        reporter = warmstart.load(args.student, config[args.student], args.term)
+        if reporter is not None and not warmstart.covers(reporter, include, 60 * args.max_age):
+            reporter = None
+    if reporter is None:
+        reporter = Reporter(config[args.student], args.term)
+        reporter.load_assignments(include)
+        if args.warm:
+            warmstart.save(args.student, reporter)
+    return reporter
+
+def run_report(reporter):
+    if args.grades:
+        print("\n==== Grades ====")
+        scores = reporter.get_course_scores()
+        for score in scores:
+            print("%-10s: %3d %1.2f %1.2f" % (score.course, score.score, score.wpoints, score.upoints))
+    elif args.low:
+        print("\n==== Assignments with low score ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Low_Score, args.min)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %s %s %d [%d%%]" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), mm_dd(status.graded_date), status.attempts, status.possible_gain))
+            assignment = reporter.get_assignment(status.id)
+            for comment in assignment.submission_comments:
+                print("%s %s %s" % (comment.author, mm_dd(comment.date), comment.text))
+    elif args.missing:
+        print("\n==== Missing assignments ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Missing, 1)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
+            assignment = reporter.get_assignment(status.id)
+            for comment in status.submission_comments:
+                print("  - %s %s %s" % (comment.author, mm_dd(comment.date), comment.text))
+    elif args.being_marked:
+        print("\n==== Assignments Being Marked ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Being_Marked, args.min)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %s %d" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), status.possible_gain))
+    elif args.has_comment:
+        print("\n==== Assignments Being Marked ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Has_Comment, args.min)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %s %d" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), status.possible_gain))
+    elif args.calendar:
+        status_list = reporter.run_calendar_report(datetime.today())
+        for status in status_list:
+            print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
+    elif args.service:
+        print("%1.1f hours of service still to do" % (reporter.get_remaining_service_hours()))
+    elif args.announcements:
+        print("\n==== Announcements ====")
+        for announcement in reporter.get_announcements():
+            print("%-10s: %s %s" % (announcement.course, mm_dd(announcement.date), announcement.title))
+    elif args.search:
+        import search
+        index = search.index_for(args.student)
+        index.update(reporter, fetch=True)
+        index.save()
+        print("\n==== Comments matching \"%s\" ====" % (args.search))
+        for hit in index.search(args.search):
+            print("%-10s: %-25.25s %s %s %s" % (hit.course, hit.assignment, mm_dd(hit.posted_date()), hit.author, hit.text))
+    elif args.history:
+        history, cumulative = reporter.get_term_history()
+        for term in history:
+            print("\n==== %s ====" % (term.term))
+            for score in term.scores:
+                print("%-10s: %3d %1.2f %1.2f" % (score.course, score.score, score.wpoints, score.upoints))
+            print("%-10s: %1.2f %1.2f" % ("GPA", term.wpoints, term.upoints))
+        print("\n==== Cumulative GPA ====")
+        print("%-10s: %1.2f %1.2f" % ("GPA", cumulative.wpoints, cumulative.upoints))
+    elif args.all:
+        print("\n=== To-day ====")
+        status_list = reporter.run_daily_submission_report(args.date)
+        for status in status_list:
+            state = status.status.name + " (%d%%)" % (status.score) if status.status == SubmissionStatus.Marked else status.status.name
+            print("%-10s: %-25.25s [%-10.10s] %d" % (status.course, status.name, state, status.possible_gain))
+        print("\n=== This week ====")
+        status_list = reporter.run_calendar_report(args.date)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
+        print("\n==== Missing assignments ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Missing, args.min)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %d" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
+        print("\n==== Assignments with low score ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Low_Score, args.min)
+        for status in status_list[0:15]:
+            print("%-10s: %-25.25s %s [%d]" % (status.course, status.name, mm_dd(status.due_date), status.possible_gain))
+        print("\n==== Assignments Being Marked ====")
+        status_list = reporter.run_assignment_report(SubmissionStatus.Being_Marked, args.min)
+        for status in status_list:
+            print("%-10s: %-25.25s %s %s %d" % (status.course, status.name, mm_dd(status.due_date), mm_dd(status.submission_date), status.possible_gain))
+        print("\n==== Grades ====")
+        scores = reporter.get_course_scores()
+        for score in scores:
+            print("%-10s: %3d %1.2f %1.2f" % (score.course, score.score, score.upoints, score.wpoints))
+    else:
+        status_list = reporter.run_daily_submission_report(args.date)
+        print("\n=== Assignments due on %s ====" % (mm_dd(args.date)))
+        for status in status_list:
+            state = status.status.name + " (%d%%)" % (status.score) if status.status == SubmissionStatus.Marked else status.status.name
+            print("%-10s: %-25.25s [%-10.10s] %d" % (status.course, status.name, state, status.possible_gain))
 
+# The trace is written even when a report fails part way
+trace = None
+try:
+    with tracing.tracing("console", args.trace, student=args.student, report=selected_report(args)) as trace:
+        run_report(load_reporter())
+finally:
+    if trace:
+        trace_path = utils.cache_path("traces", "{}-{}.json".format(args.student, int(trace.started)))
+        with open(trace_path, "w") as json_file:
+            json_file.write(tracing.to_json(trace))
+        print("\nTrace written to {}".format(trace_path))
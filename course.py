@@ -1,20 +1,19 @@
 import logging
+import threading
+import pytz
+import tracing
 import utils
+from catalog import catalogs
+from datetime import datetime, timedelta
 from types import SimpleNamespace
 from typing import NamedTuple
 from assignment import Assignment
 
-# graded_courses = ["History", "Spanish", "Chemistry", "Algebra", "Geometry", "Geo/Trig", "Calculus", "English", "Theology", "Biology", "Physics", "Computer",
-#                   "Government", "Financing", "Law", "Politics", "Ceramics", "Wellness", "Photography", "Statistics", "STEM", "Environment",
+# Assignments per get_multiple_submissions call when prefetching comments
+COMMENT_BATCH_SIZE = 50
 
-graded_courses = [ "CINE 260M", "CS 111", "EC 201", "MATH 111",
-                  "J 100", "J 350", "MUS 151", "MUS 227",
-                  "PPPM 101", "GEOG 208", "LING 201",
-                  "ANTH 110", "ARTD 251", "MUS 151",
-                  "CRWR 230", "HUM 102", "PEL 399",
-                  "GEOG 1400", "WRTG 2010", "GEO 1100", "MATH 1060",
-                  "CHEM 1210", "CHEM 1215", "ART 1020", "GEO 1030", "MATH 1210",
-                  "GEOG 3100", "ATMOS 1120", "PHYS 2210", "SCI 1500"]
+# Reports look at most a week ahead, so later assignments never need their comments up front
+COMMENT_HORIZON = timedelta(days=8)
 
 class CourseScore(NamedTuple):
     course: str
@@ -22,26 +21,40 @@ class CourseScore(NamedTuple):
     wpoints: float
     upoints: float
 
+# Courses listed with include=["total_scores"] carry the student's enrollment scores,
+# so there is no need to fetch enrollments separately
+def enrollment_from_course(course):
+    for e in getattr(course, "enrollments", None) or []:
+        return SimpleNamespace(course_id=course.id, grades={"current_score": e.get("computed_current_score")})
+    return None
+
+class CourseAssignments(NamedTuple):
+    valid: dict
+    invalid: dict
+    comment_candidates: dict
+
 class Course:
-    def __init__(self, course, enrollment):
+    # catalog is that of the Canvas instance the course is from, see catalog.py
+    def __init__(self, course, enrollment=None, catalog=None):
         self.raw = course
-        self.enrollment=enrollment
-        self.is_valid = False
+        self.enrollment = enrollment if enrollment is not None else enrollment_from_course(course)
+        self.catalog = catalog if catalog is not None else catalogs.get()
         self.id = self.raw.id
-        self.is_honors = "Honors" in self.raw.name or "AP" in self.raw.name
+        classified = self.catalog.classify_course(self.id, self.raw.name)
+        self.name = classified.name
+        self.is_valid = classified.is_valid
+        self.is_honors = classified.is_honors
+        self.is_service = classified.is_service
         self.logger = logging.getLogger(__name__)
-        self.term = self.raw.term["name"].split(' ')[0]
+        self.term_name = self.raw.term["name"]
+        self.term = self.term_name.split(' ')[0]
         self.has_grade = not self.raw.hide_final_grades
-        name = course if isinstance(course, str) else course.name
-        self.name = None
-        for short_name in graded_courses:
-            if short_name in name:
-                self.name = short_name
-                self.is_valid = True
-        if "Service" in name:
-            self.name = "Service"
-        if not self.name:
-            self.name = name
+        self.assignments = {}
+        self.invalid_assignments = {}
+        self.comment_candidates = {}
+        self.comment_lock = threading.Lock()
+        self.loaded_at = None
+        self.stale = False
 
     def is_current(self, date):
         if self.raw.term["end_at"]:
@@ -49,6 +62,10 @@ class Course:
         else:
             return False
 
+    def is_finished(self, date):
+        end_at = self.raw.term["end_at"]
+        return end_at is not None and utils.convert_date(end_at) <= date
+
     def get_grade_points(self, score):
         table  = [
             (97, 4.30, 4),
@@ -74,8 +91,9 @@ class Course:
         if self.is_valid:
             if self.has_grade:
                 score = self.enrollment.grades.get('current_score')
-            else:
-                score=calculator.score_totals[self.id]/calculator.weighting_totals[self.id]
+            elif calculator.weighting_totals.get(self.id):
+                # Not there for a course that has never loaded, e.g. one that missed its first deadline
+                score=calculator.score_totals.get(self.id, 0)/calculator.weighting_totals[self.id]
             if score is not None:
                 score = int(score + 0.5)
                 grade_points = self.get_grade_points(score)
@@ -85,45 +103,144 @@ class Course:
                 return CourseScore(self.name, score, grade_points.weighted, grade_points.unweighted)
         return score
 
+    # Fetches and ingests every assignment once, valid and invalid (excused, unscored or
+    # undated) alike, so later readers of either index need no further API calls
+    def fetch_assignments(self, user):
+        raw_assignments = list(self.raw.get_assignments(order_by="due_at"))
+        assignment_ids = []
+        for a in raw_assignments:
+            assignment_ids.append(a.id)
+        raw_submissions = self.raw.get_multiple_submissions(assignment_ids=assignment_ids, student_ids=[user.id])
+        submissions = {}
+        for s in raw_submissions:
+            submissions[s.assignment_id] = s
+        return self.ingest(user, raw_assignments, submissions)
+
+    def ingest(self, user, raw_assignments, submissions):
+        horizon = datetime.now(pytz.UTC) + COMMENT_HORIZON
+        loaded = CourseAssignments({}, {}, {})
+        trace = tracing.active()
+        for a in raw_assignments:
+            submission = submissions[a.id]
+            if not hasattr(submission, "score"):
+                setattr(submission, "score", None)
+            if not hasattr(submission, "attempt"):
+                setattr(submission, "attempt", 0)
+            a.submission = submission
+            assignment = Assignment(user, self.name, a, self.load_submission_comments)
+            if trace:
+                trace.event("ingest.assignment", course=self.name, assignment=a.id, name=assignment.get_name(), updated=a.updated_at,
+                            submitted=submission.submitted_at, valid=assignment.is_valid)
+            if assignment.is_valid:
+                loaded.valid[a.id] = assignment
+            else:
+                loaded.invalid[a.id] = assignment
+            if assignment.may_need_comments(horizon):
+                loaded.comment_candidates[a.id] = assignment
+        return loaded
+
+    def commit(self, loaded):
+        with self.comment_lock:
+            self.assignments, self.invalid_assignments, self.comment_candidates = loaded
+            self.loaded_at = datetime.now(pytz.UTC)
+            self.stale = False
+
+    # The last load missed its deadline or failed, reports keep the assignments loaded before
+    def mark_stale(self):
+        with self.comment_lock:
+            self.stale = True
+
+    def load_assignments(self, user):
+        self.commit(self.fetch_assignments(user))
+        return self.assignments
+
+    # Files an assignment under the right index after an update changed its validity
+    def reindex(self, assignment):
+        with self.comment_lock:
+            self.assignments.pop(assignment.id, None)
+            self.invalid_assignments.pop(assignment.id, None)
+            if assignment.is_valid:
+                self.assignments[assignment.id] = assignment
+            else:
+                self.invalid_assignments[assignment.id] = assignment
+
+    def find_assignment(self, id):
+        return self.assignments.get(id) or self.invalid_assignments.get(id)
+
     def get_assignments(self, user, get_invalid=False):
-        assignments = {}
-        if self.is_valid or get_invalid:
-            raw_assignments = self.raw.get_assignments(order_by="due_at")
-            assignment_ids = []
-            for a in raw_assignments:
-                assignment_ids.append(a.id)
-            raw_submissions = self.raw.get_multiple_submissions(assignment_ids=assignment_ids, student_ids=[user.id], include=["submission_comments"])
-            submissions = {}
-            for s in raw_submissions:
-                submissions[s.assignment_id] = s
-            for a in raw_assignments:
-                submission = submissions[a.id]
-                if not hasattr(submission, "score"):
-                    setattr(submission, "score", None)
-                if not hasattr(submission, "attempt"):
-                    setattr(submission, "attempt", 0)
-                a.submission = submission
-                assignment = Assignment(user, self.name, a)
-                self.logger.info("   - name: {}".format(assignment.get_name()))
-                self.logger.info("   - last updated: {}".format(a.updated_at))
-                self.logger.info("   - submitted: {}".format(assignment.get_submission_date()))
-                if assignment.is_valid or get_invalid:
-                    assignments[a.id] = assignment
-        return assignments
+        if not (self.is_valid or get_invalid):
+            return {}
+        if self.loaded_at is None:
+            self.load_assignments(user)
+        if get_invalid:
+            return {**self.assignments, **self.invalid_assignments}
+        return self.assignments
+
+    # Loads comments for every candidate still pending in one batched request per
+    # COMMENT_BATCH_SIZE assignments, or just for the given assignment if it is not a candidate
+    def load_submission_comments(self, assignment=None):
+        with self.comment_lock:
+            if assignment is not None and assignment.have_loaded_submission_comments:
+                return
+            if assignment is None or assignment.id in self.comment_candidates:
+                pending = [a for a in self.comment_candidates.values() if not a.have_loaded_submission_comments]
+            else:
+                pending = [assignment]
+            if not pending:
+                return
+            self.fetch_comments(pending)
+
+    # Loads comments for any of the given assignments that have none yet, e.g. for the search
+    # index in the background
+    def load_comments_for(self, assignments):
+        self.fetch_comments_unlocked([a for a in assignments if not a.have_loaded_submission_comments], False)
+
+    # Loads the comments of the given assignments again, replacing those already loaded
+    def reload_comments_for(self, assignments):
+        self.fetch_comments_unlocked(list(assignments), True)
+
+    # The lock is only held to store each batch, so foreground loads never wait behind
+    # background requests
+    def fetch_comments_unlocked(self, pending, replace):
+        for start in range(0, len(pending), COMMENT_BATCH_SIZE):
+            batch = pending[start:start + COMMENT_BATCH_SIZE]
+            comments = self.get_comments(batch)
+            with self.comment_lock:
+                for a in batch:
+                    if replace or not a.have_loaded_submission_comments:
+                        a.set_submission_comments(comments.get(a.id, []))
+        if pending:
+            self.logger.info("{}: loaded comments for {} assignments".format(self.name, len(pending)))
 
+    # Called with comment_lock held
+    def fetch_comments(self, pending):
+        for start in range(0, len(pending), COMMENT_BATCH_SIZE):
+            batch = pending[start:start + COMMENT_BATCH_SIZE]
+            comments = self.get_comments(batch)
+            for a in batch:
+                a.set_submission_comments(comments.get(a.id, []))
+        self.logger.info("{}: loaded comments for {} assignments".format(self.name, len(pending)))
+
+    # Raw comments of a batch of assignments by assignment id, in one request
+    def get_comments(self, batch):
+        raw_submissions = self.raw.get_multiple_submissions(assignment_ids=[a.id for a in batch], student_ids=[batch[0].user.id], include=["submission_comments"])
+        comments = {}
+        for s in raw_submissions:
+            comments[s.assignment_id] = s.submission_comments
+        return comments
+
+    # The student's submission with extra include options, fetched the same way for REST
+    # and GraphQL loaded courses (whose raw assignments are plain namespaces)
+    def fetch_submission(self, assignment, include):
+        for s in self.raw.get_multiple_submissions(assignment_ids=[assignment.id], student_ids=[assignment.user.id], include=include):
+            return s
+        return None
 
     def assignment_groups(self):
-        groups = self.raw.get_assignment_groups()
-        filtered_groups = []
-        for group in groups:
-            valid = True
-            for name in ["Attendance", "Imported Assignments", "Extra"]:
-                if name in group.name:
-                    valid = False
-                    break
-            if valid:
-                filtered_groups.append(group)
-        return filtered_groups
+        return self.filter_groups(self.raw.get_assignment_groups())
+
+    def filter_groups(self, groups):
+        return self.catalog.filter_groups(groups)
 
     def assignment_group(self, id):
         groups = self.raw.get_assignment_groups()
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from singleflight import SingleFlight
+import utils
+
+# Rubric assessments and submission history shown on an assignment's detail page. Neither
+# is part of the main load; both come from one submission request with include options the
+# first time a page is opened, and are kept until the submission changes.
+
+DETAIL_INCLUDES = ["rubric_assessment", "submission_history"]
+
+
+class RubricRow(NamedTuple):
+    criterion: str
+    rating: str
+    points: float
+    points_possible: float
+    comments: str
+
+
+class AttemptRow(NamedTuple):
+    attempt: int
+    submitted: object
+    graded: object
+    score: float
+    late: bool
+    state: str
+
+
+class AssignmentDetails(NamedTuple):
+    rubric: tuple
+    history: tuple
+    fetched_at: float
+
+
+def date_or_none(canvas_date):
+    return utils.convert_date(utils.canvas_date(canvas_date)) if canvas_date else None
+
+# Changes whenever Canvas updates the submission, or events.py applies a change to it
+def submission_version(submission):
+    return (getattr(submission, "updated_at", None), submission.submitted_at, getattr(submission, "graded_at", None),
+            submission.attempt, submission.score, getattr(submission, "workflow_state", None))
+
+# Criteria in the order of the assignment's rubric, or of the assessment if the rubric
+# itself was not loaded with the assignment
+def rubric_rows(rubric, assessment):
+    rows = []
+    criteria = rubric or [{"id": id, "description": id} for id in assessment]
+    for criterion in criteria:
+        assessed = assessment.get(criterion["id"], {})
+        rating = ""
+        for r in criterion.get("ratings", []):
+            if r.get("id") == assessed.get("rating_id"):
+                rating = r.get("description", "")
+        rows.append(RubricRow(criterion.get("description", ""), rating, assessed.get("points"), criterion.get("points"), assessed.get("comments") or ""))
+    return tuple(rows)
+
+def history_rows(history):
+    rows = []
+    for s in history:
+        if s.get("attempt") is None and s.get("submitted_at") is None:
+            continue
+        rows.append(AttemptRow(s.get("attempt") or 0, date_or_none(s.get("submitted_at")), date_or_none(s.get("graded_at")),
+                               s.get("score"), bool(s.get("late")), s.get("workflow_state", "")))
+    rows.sort(key=lambda r: r.attempt)
+    return tuple(rows)
+
+
+class DetailCache:
+    def __init__(self, size=512):
+        self.logger = logging.getLogger(__name__)
+        self.size = size
+        self.details = OrderedDict()
+        self.lock = threading.Lock()
+        self.fetches = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, student, course, assignment):
+        key = (student, assignment.id)
+        version = submission_version(assignment.submission)
+        with self.lock:
+            cached = self.details.get(key)
+            if cached is not None and cached[0] == version:
+                self.details.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        details = self.fetches.do(key, self.fetch, course, assignment)
+        with self.lock:
+            self.details[key] = (version, details)
+            self.details.move_to_end(key)
+            if len(self.details) > self.size:
+                self.details.popitem(last=False)
+        return details
+
+    def fetch(self, course, assignment):
+        start_time = time.time()
+        submission = course.fetch_submission(assignment, DETAIL_INCLUDES)
+        details = AssignmentDetails(rubric_rows(getattr(assignment.assignment, "rubric", None), getattr(submission, "rubric_assessment", None) or {}),
+                                    history_rows(getattr(submission, "submission_history", None) or []),
+                                    time.time())
+        self.logger.info("Loaded details of {} in {}s".format(assignment.id, time.time() - start_time))
+        return details
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.details)}
+
+
+details = DetailCache()
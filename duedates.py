@@ -0,0 +1,32 @@
+import bisect
+
+
+# Valid assignments sorted by due time, with the span of each local day in the student's
+# timezone, so the daily and calendar reports are range lookups returning rows in order.
+# Built once per set of assignments; Reporter.due_dates() rebuilds it when they are replaced.
+class DueDateIndex:
+    def __init__(self, assignments, timezone):
+        self.source = assignments
+        self.timezone = timezone
+        entries = sorted((a.due_date.timestamp(), a.id, a) for a in assignments.values() if a.is_valid and a.due_date is not None)
+        self.times = [entry[0] for entry in entries]
+        self.assignments = [entry[2] for entry in entries]
+        self.days = {}
+        for i, assignment in enumerate(self.assignments):
+            day = assignment.due_date.astimezone(timezone).date()
+            first, _ = self.days.get(day, (i, i))
+            self.days[day] = (first, i + 1)
+
+    def is_current(self, assignments, timezone):
+        return self.source is assignments and self.timezone is timezone
+
+    # Due on the student's local day of date
+    def on_day(self, date):
+        first, end = self.days.get(date.astimezone(self.timezone).date(), (0, 0))
+        return self.assignments[first:end]
+
+    # Due strictly after start and before end
+    def between(self, start, end):
+        first = bisect.bisect_right(self.times, start.timestamp())
+        last = bisect.bisect_left(self.times, end.timestamp())
+        return self.assignments[first:last]
@@ -0,0 +1,88 @@
+import logging
+from typing import NamedTuple
+import utils
+
+# Submission fields a change event may carry, under their REST names
+submission_fields = ["submitted_at", "graded_at", "score", "attempt", "late", "missing", "excused", "workflow_state"]
+
+date_fields = ["submitted_at", "graded_at", "due_at", "lock_at", "created_at"]
+
+event_names = ["submission_created", "submission_updated", "grade_change", "submission_comment_created", "assignment_updated"]
+
+
+# One Canvas change event, reduced to the attribute updates it implies. assignment and
+# submission hold REST attribute names and values, comment a raw REST submission comment.
+class ChangeEvent(NamedTuple):
+    name: str
+    user_id: int
+    course_id: int
+    assignment_id: int
+    submission_id: int
+    assignment: dict
+    submission: dict
+    comment: dict
+
+
+def optional_id(value):
+    return utils.local_id(value) if value not in (None, "") else None
+
+def rest_values(body, fields):
+    values = {}
+    for field in fields:
+        if field in body:
+            value = body[field]
+            values[field] = utils.canvas_date(value) if field in date_fields else value
+    return values
+
+# Accepts Canvas Live Events ({"metadata": {"event_name": ...}, "body": {...}}) and
+# webhook-style payloads that put event_name next to the body fields
+def parse_event(payload):
+    metadata = payload.get("metadata", {})
+    name = metadata.get("event_name") or payload.get("event_name")
+    body = payload.get("body", payload)
+    if name not in event_names:
+        return None
+    course_id = optional_id(body.get("context_id") or metadata.get("context_id"))
+    assignment_id = optional_id(body.get("assignment_id"))
+    submission_id = optional_id(body.get("submission_id"))
+    user_id = optional_id(body.get("student_id") or body.get("user_id"))
+    assignment = {}
+    submission = {}
+    comment = {}
+    if name in ["submission_created", "submission_updated"]:
+        submission = rest_values(body, submission_fields)
+    elif name == "grade_change":
+        submission = rest_values(body, ["score", "graded_at"])
+        submission.setdefault("graded_at", utils.canvas_date(metadata.get("event_time")))
+        if body.get("grading_complete", True):
+            submission["workflow_state"] = "graded"
+    elif name == "submission_comment_created":
+        # user_id is the comment's author here, the student is found from the submission
+        comment = {"author_id": user_id, "created_at": utils.canvas_date(body.get("created_at")), "comment": body.get("body", "")}
+        user_id = None
+    elif name == "assignment_updated":
+        assignment = rest_values(body, ["due_at", "lock_at", "points_possible"])
+        if "title" in body:
+            assignment["name"] = body["title"]
+        user_id = None
+    return ChangeEvent(name, user_id, course_id, assignment_id, submission_id, assignment, submission, comment)
+
+
+# Applies each payload to every reporter it concerns. Returns the number of updates
+# applied and the students whose data changed.
+def apply_events(reporters, payloads):
+    logger = logging.getLogger(__name__)
+    applied = 0
+    changed = set()
+    for payload in payloads:
+        event = parse_event(payload)
+        if event is None:
+            logger.info("Ignoring event {}".format(payload.get("metadata", payload).get("event_name")))
+            continue
+        for student, reporter in reporters.items():
+            if event.user_id is not None and reporter.user.id != event.user_id:
+                continue
+            if reporter.apply_event(event):
+                applied += 1
+                changed.add(student)
+    return applied, changed
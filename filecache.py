@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+import concurrent.futures
+from singleflight import SingleFlight
+import utils
+
+CHUNK_SIZE = 64 * 1024
+
+# A .part file untouched for this long belongs to a download nobody resumed, and is deleted
+PART_EXPIRY = 24 * 3600
+
+
+# Total size from a Content-Range header ("bytes 0-99/200" or "bytes */200"), None if unknown
+def range_total(content_range):
+    total = content_range.rsplit("/", 1)[-1] if content_range else "*"
+    return int(total) if total.isdigit() else None
+
+
+# Course files downloaded once and kept on disk. Entries are named by Canvas file ID plus a
+# hash of updated_at and size, so a changed file gets a new entry and files with the same
+# name in different courses never collide. Downloads stream into a .part file and resume
+# from where they stopped with a Range request. Once the cache, .part files included, grows
+# past max_bytes the least recently used entries are evicted; .part files only expire.
+class FileCache:
+    def __init__(self, directory="files", max_bytes=500 * 1024 * 1024, workers=4):
+        self.logger = logging.getLogger(__name__)
+        self.root = os.path.dirname(utils.cache_path(directory, "entry"))
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.downloads = SingleFlight()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired_parts = 0
+
+    def path(self, file):
+        version = hashlib.sha1("{}:{}".format(getattr(file, "updated_at", ""), getattr(file, "size", "")).encode()).hexdigest()[:12]
+        extension = os.path.splitext(file.filename)[1]
+        return os.path.join(self.root, "{}-{}{}".format(file.id, version, utils.safe_filename(extension)))
+
+    # Local path of the file's current version, downloading it first if needed
+    def get(self, file):
+        path = self.path(file)
+        try:
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.misses += 1
+        return self.downloads.do(path, self.download, file, path)
+
+    # Downloads several files at once, returns their paths by file ID (None if it failed)
+    def prefetch(self, files):
+        paths = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.get, file): file for file in files}
+            for future in concurrent.futures.as_completed(futures):
+                file = futures[future]
+                try:
+                    paths[file.id] = future.result()
+                except (OSError, urllib.error.URLError) as e:
+                    self.logger.warning("Download of {} failed: {}".format(file.filename, e))
+                    paths[file.id] = None
+        return paths
+
+    def download(self, file, path):
+        if os.path.exists(path):
+            return path
+        part = path + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        request = urllib.request.Request(file.url)
+        if offset:
+            request.add_header("Range", "bytes={}-".format(offset))
+        # Canvas lists the size; otherwise the response says how big the whole file is
+        size = getattr(file, "size", None)
+        try:
+            response = urllib.request.urlopen(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            # 416: the partial file already holds everything
+            if e.code != 416:
+                raise
+            response = None
+            if size is None:
+                size = range_total(e.headers.get("Content-Range"))
+        if response is not None:
+            with response:
+                if size is None:
+                    length = response.headers.get("Content-Length")
+                    size = range_total(response.headers.get("Content-Range")) if response.status == 206 else int(length) if length else None
+                mode = "ab" if response.status == 206 else "wb"
+                with open(part, mode) as out:
+                    shutil.copyfileobj(response, out, CHUNK_SIZE)
+        if size is None:
+            raise OSError("Size of {} unknown, download cannot be checked".format(file.filename))
+        if os.path.getsize(part) != size:
+            raise OSError("Incomplete download of {}: {} of {} bytes".format(file.filename, os.path.getsize(part), size))
+        os.replace(part, path)
+        self.logger.info("Downloaded {} to {}".format(file.filename, path))
+        self.evict(keep=path)
+        return path
+
+    # Files may vanish while this runs, e.g. when another process shares the directory
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self, keep=None):
+        with self.lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".part"):
+                    if now - stat.st_mtime > PART_EXPIRY:
+                        if self.remove(path):
+                            self.expired_parts += 1
+                            self.logger.info("Expired {}".format(path))
+                        continue
+                elif path != keep:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if self.remove(path):
+                    self.evictions += 1
+                    self.logger.info("Evicted {}".format(path))
+                total -= size
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "expired_parts": self.expired_parts}
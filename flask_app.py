@@ -1,18 +1,39 @@
+import hmac
+import os
 import time
 import json
-from flask import Flask, request
-from flask import render_template
-from flask_table import Table, Col, LinkCol
+import threading
+import urllib.error
+from collections import OrderedDict
+from canvasapi.exceptions import ResourceDoesNotExist
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
+from flask import render_template, send_file
 from datetime import datetime
 import pytz
 from typing import NamedTuple
-from reporter import Reporter
+from registry import ReporterRegistry
+from scheduler import scheduler
+from metrics import metrics
+from snapshot import Snapshot, snapshots
+from ics import calendar_feed
+from events import apply_events
+from live import LiveRefresher
+from fleet import FleetScheduler
+import warmstart
+import tracing
+import search
+from catalog import catalogs
+from details import details
+from filecache import FileCache
 from assignment import Assignment, AssignmentStatus, SubmissionStatus
 import logging
 
+# Bounds on the Reporters kept in memory, see registry.py
+REPORTER_MAX_MB = int(os.environ.get("CCANVAS_REPORTER_MB", 256))
+REPORTER_TTL_SECONDS = int(os.environ.get("CCANVAS_REPORTER_TTL", 6 * 3600))
+
 class ReporterFactory(object):
     students = {}
-    instances = {}
     current_student = None
 
     @staticmethod
@@ -23,167 +44,353 @@ class ReporterFactory(object):
         return ReporterFactory.students.keys()
 
     @staticmethod
-    def create(student):
-        if not student in ReporterFactory.instances:
-            ReporterFactory.get_students()
-            student = student.lower()
-            #api_key = ReporterFactory.students[student]['key']
-            #user_id = ReporterFactory.students[student]['id']
+    def create(student, current=True):
+        student = student.lower()
+        if current:
             ReporterFactory.current_student = student
-            ReporterFactory.instances[student] = Reporter(ReporterFactory.students[student])
-        return ReporterFactory.instances[student]
+        return reporters.get(student)
+
+    @staticmethod
+    def build(student):
+        ReporterFactory.get_students()
+        # Reports start from the last saved state while Canvas is re-read in the background
+        def reconciled(reporter):
+            snapshots.put(Snapshot.build(student, reporter))
+        return warmstart.start(student, ReporterFactory.students[student], reconciled)
 
     @staticmethod
     def get():
         if ReporterFactory.current_student:
-            return ReporterFactory.instances[ReporterFactory.current_student]
+            return reporters.get(ReporterFactory.current_student)
         else:
             return None
 
+reporters = ReporterRegistry(ReporterFactory.build, REPORTER_MAX_MB * 1024 * 1024, REPORTER_TTL_SECONDS)
+
+# Once change events arrive for a student, full reloads only run this often to reconcile
+RECONCILE_SECONDS = int(os.environ.get("CCANVAS_RECONCILE", 15 * 60))
+
+# How often students with an open dashboard are refreshed, and streams are kept alive
+LIVE_REFRESH_SECONDS = int(os.environ.get("CCANVAS_LIVE_REFRESH", 120))
+STREAM_KEEPALIVE_SECONDS = 30
+
+# Worker processes for refreshing every student in the background, off when 0
+FLEET_SHARDS = int(os.environ.get("CCANVAS_FLEET_SHARDS", 0))
+
+# Shared secret event senders put in X-Event-Secret. Without one /events refuses everything,
+# unless CCANVAS_EVENTS_INSECURE=1 opts in to unchecked events (e.g. with standin.py locally).
+EVENT_SECRET = os.environ.get("CCANVAS_EVENT_SECRET")
+EVENTS_INSECURE = os.environ.get("CCANVAS_EVENTS_INSECURE") == "1"
+
 def mm_dd(date):
     if (date):
         return date.strftime("%m/%d")
     else:
         return "??/??"
 
-class ScoreTable(Table):
-    course = Col('Course')
-    score = Col('Score')
-
-class CourseStatusString:
-    def __init__(self, c):
-        self.course = c.course
-        self.score = c.score
-        self.wpoints = int(100*c.wpoints)/100
-        self.upoints = int(100*c.upoints)/100
-
-class AssignmentStatusString:
-    def __init__(self, a):
-        self.course = a.course
-        self.id = a.id
-        self.name = a.name[0:25]
-        self.status = a.status.name
-        self.due = mm_dd(a.due_date)
-        self.submitted = mm_dd(a.submission_date)
-        self.graded = mm_dd(a.graded_date)
-        self.score = int(a.possible_gain)
-        self.attempts = a.attempts
-        self.possible_gain = a.possible_gain
-
-class CommentStatusString:
-    def __init__(self, c):
-        self.author = c.author
-        self.date = mm_dd(c.date)
-        self.text = c.text
-
-class AssignmentTable(Table):
-    course = Col('Course')
-    name = LinkCol('Name', 'single_item',
-                   url_kwargs=dict(assignment_id='id'), attr='name')
-    due = Col('Due')
-    score = Col('Gain')
-
-class AssignmentStatusTable(Table):
-    course = Col('Course')
-    name = Col('Assignment')
-    status = Col('Status')
-    possible_gain = Col('Gain')
-
-class AssignmentScoreTable(Table):
-    course = Col('Course')
-    name = LinkCol('Name', 'single_item',
-                   url_kwargs=dict(assignment_id='id'), attr='name')
-    due = Col(' Due ')
-    submitted = Col(' Done ')
-    graded = Col('Graded')
-    attempts = Col('Try')
-    score = Col('Gain')
-
-class CourseTable(Table):
-    course = Col('Course')
-    score = Col('Score')
-    wpoints = Col('WGPA')
-    upoints = Col('UGPA')
-
-class AnnouncementTable(Table):
-    due = Col('Date')
-    course = Col('Course')
-
-class CommentTable(Table):
-    author = Col('Author')
-    date = Col('Date')
-    text = Col('Comment')
-
-def to_string_table(assignments, layout):
-    table_entries = {
-        AssignmentScoreTable  : AssignmentStatusString,
-        AssignmentStatusTable : AssignmentStatusString,
-        AssignmentTable       : AssignmentStatusString,
-        CourseTable           : CourseStatusString,
-        AnnouncementTable     : CommentStatusString,
-        CommentTable          : CommentStatusString
-    }
-    table_entry = table_entries[layout]
-    table=[]
-    for assignment in assignments:
-        table.append(table_entry(assignment))
-    return layout(table)
-
-def run_assignment_report(reporter, query, min_gain):
-    table = AssignmentTable
-    report = reporter.run_assignment_report(query, min_gain)
-    return to_string_table(report, table)
-
-logging.basicConfig(level=logging.INFO)
+# Report rows are plain tuples in the column order of the macros in templates/tables.html
+def score_row(c):
+    return (c.course, c.score, int(100*c.wpoints)/100, int(100*c.upoints)/100)
+
+def status_row(a):
+    return (a.course, a.name[0:25], a.status, a.possible_gain)
+
+def assignment_row(student, a):
+    return (student, a.course, a.id, a.name[0:25], mm_dd(a.due_date()), int(a.possible_gain))
+
+def announcement_row(a):
+    return (mm_dd(a.posted_date()), a.course, a.title)
+
+def comment_row(c):
+    return (c.author, mm_dd(c.date), c.text)
+
+def hit_row(student, h):
+    return (student, mm_dd(h.posted_date()), h.course, h.assignment_id, h.assignment[0:25], h.author, h.text)
+
+def rubric_row(r):
+    return (r.criterion, r.rating, r.points, r.points_possible, r.comments)
+
+def attempt_row(a):
+    return (a.attempt, mm_dd(a.submitted), mm_dd(a.graded), a.score, "Late" if a.late else "", a.state)
+
+# Rendered tables keyed by macro and rows, so an unchanged section is never rendered twice
+class FragmentCache:
+    def __init__(self, size=256):
+        self.size = size
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, macro, rows, no_items="No Items"):
+        key = (macro, no_items, request.script_root, rows)
+        with self.lock:
+            fragment = self.fragments.get(key)
+            if fragment is not None:
+                self.fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        fragment = getattr(app.jinja_env.get_template('tables.html').module, macro)(rows, no_items)
+        with self.lock:
+            self.fragments[key] = fragment
+            if len(self.fragments) > self.size:
+                self.fragments.popitem(last=False)
+        return fragment
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.fragments)}
+
+fragments = FragmentCache()
+
+def render_table(macro, items, to_row, no_items="No Items"):
+    return fragments.render(macro, tuple(to_row(item) for item in items), no_items)
+
+file_cache = FileCache()
+
+def refresh_student(student):
+    with tracing.tracing("refresh", student_traced(student), student=student):
+        reporter = ReporterFactory.create(student, current=False)
+        reporter.load_assignments_if_stale(RECONCILE_SECONDS if reporter.events_applied else LIVE_REFRESH_SECONDS)
+        warmstart.save_if_changed(student, reporter)
+        snapshots.put(Snapshot.build(student, reporter))
+
+live = LiveRefresher(refresh_student, LIVE_REFRESH_SECONDS)
+
+logging.basicConfig(level=logging.WARNING)
 app = Flask(__name__)
+metrics.register("fragments", fragments.stats)
+metrics.register("canvas", scheduler.stats)
+metrics.register("reporters", reporters.stats)
+metrics.register("traces", tracing.traces.stats)
+metrics.register("catalogs", catalogs.stats)
+metrics.register("details", details.stats)
+metrics.register("files", file_cache.stats)
+metrics.register("live", live.stats)
 
 @app.route("/")
 def home():
     return render_template('index.html', students = ReporterFactory.get_students())
 
-@app.route('/assignment/<int:assignment_id>')
-def single_item(assignment_id):
-    reporter = ReporterFactory.get()
-    assignment = reporter.get_assignment(assignment_id)
-    comments = to_string_table(assignment.submission_comments, CommentTable)
-    comments.no_items = "No comments"
-    return render_template('assignment.html', assignment = AssignmentStatus(assignment), comments = comments)
+# Rubric and submission history are fetched on the first view and cached until the submission changes
+@app.route('/student/<student>/assignment/<int:assignment_id>')
+def single_item(student, assignment_id):
+    student = student.lower()
+    if student not in ReporterFactory.get_students():
+        return "Unknown student {}".format(student), 404
+    reporter = ReporterFactory.create(student, current=False)
+    # Links outlive the reporter they came from, e.g. after a restart or an eviction. Only a
+    # reporter that has never loaded is loaded here, live refresh keeps the others fresh.
+    if reporter.loaded_at is None:
+        reporter.load_assignments()
+    course, assignment = reporter.find_assignment(assignment_id)
+    if assignment is None:
+        return "No assignment {} for {}".format(assignment_id, student), 404
+    assignment_details = details.get(student, course, assignment)
+    comments = render_table("comments", assignment.submission_comments, comment_row, "No comments")
+    rubric = render_table("rubric", assignment_details.rubric, rubric_row, "No rubric assessment")
+    history = render_table("attempts", assignment_details.history, attempt_row, "No submissions")
+    return render_template('assignment.html', student=student, assignment=AssignmentStatus(assignment), comments=comments, rubric=rubric, history=history)
 
-@app.route("/all")
-def all():
-    start_time = time.time()
-    student = request.args.get('student')
-    low_min_gain = int(request.args.get('min_gain'))
-    missing_min_gain = int(request.args.get('include_zero_scores') is None)
-    reporter = ReporterFactory.create(student)
-    reporter.load_assignments()
-    scores_list = reporter.get_course_scores()
-    scores = to_string_table(scores_list, CourseTable)
-    date = datetime.today().astimezone(pytz.timezone('US/Pacific')).strftime("%m/%d/%y %I:%M %p")
-    today_list = reporter.run_daily_submission_report(datetime.today())
-    today = to_string_table(today_list, AssignmentStatusTable)
-    week = to_string_table(reporter.run_calendar_report(datetime.today()), AssignmentTable)
-    missing = run_assignment_report(reporter, SubmissionStatus.Missing, missing_min_gain)
-    missing.no_items = "No missing assignments - nice work!"
-    low_score = run_assignment_report(reporter, SubmissionStatus.Low_Score, low_min_gain)
-    being_marked = run_assignment_report(reporter, SubmissionStatus.Being_Marked, 0)
-    has_comment = run_assignment_report(reporter, SubmissionStatus.Has_Comment, 1)
+# Course files, downloaded from Canvas into the file cache once and served from disk after that
+@app.route('/student/<student>/course/<int:course_id>/file/<int:file_id>')
+def course_file(student, course_id, file_id):
+    student = student.lower()
+    if student not in ReporterFactory.get_students():
+        return "Unknown student {}".format(student), 404
+    course = ReporterFactory.create(student, current=False).courses.get(course_id)
+    if course is None:
+        return "No course {} for {}".format(course_id, student), 404
+    try:
+        file = course.raw.get_file(file_id)
+    except ResourceDoesNotExist:
+        return "No file {} in {}".format(file_id, course.name), 404
+    try:
+        path = file_cache.get(file)
+    except (OSError, urllib.error.URLError) as e:
+        return "Download of {} failed: {}".format(file.filename, e), 502
+    return send_file(os.path.abspath(path), mimetype=getattr(file, "content-type", None), download_name=file.filename)
+
+# Rendered tables and summary figures for a snapshot's sections
+def render_sections(student, sections, low_min_gain):
+    scores_list = sections["scores"]
+    today_list = sections["today"]
+    missing_list = sections["missing"]
+    low_score_list = [a for a in sections["low_score"] if a.possible_gain >= low_min_gain]
+    being_marked_list = sections["being_marked"]
+    has_comment_list = [a for a in sections["has_comment"] if a.possible_gain >= 1]
     wgpa = scores_list[-1].wpoints if scores_list else 0
     ugpa = scores_list[-1].upoints if scores_list else 0
+    assignment_row_for = lambda a: assignment_row(student, a)
+    tables = {
+        "scores":       render_table("scores", scores_list, score_row),
+        "today":        render_table("statuses", today_list, status_row),
+        "week":         render_table("assignments", sections["week"], assignment_row_for),
+        "missing":      render_table("assignments", missing_list, assignment_row_for, "No missing assignments - nice work!"),
+        "low_score":    render_table("assignments", low_score_list, assignment_row_for),
+        "being_marked": render_table("assignments", being_marked_list, assignment_row_for),
+        "has_comment":  render_table("assignments", has_comment_list, assignment_row_for),
+        "announcements": render_table("announcements", sections.get("announcements", ()), announcement_row, "No new announcements")
+    }
     summary = {
-        "todo":         len(today.items),
-        "wgpa":         wgpa,
-        "ugpa":         ugpa,
-        "service":      reporter.get_remaining_service_hours(),
-        "time":         int(time.time() - start_time + 0.5),
-        "missing":      len(missing.items),
-        "low":          len(low_score.items),
-        "being_marked": len(being_marked.items),
-        "has_comment":  len(has_comment.items)
+        "todo":         len(today_list),
+        "wgpa":         '%1.2f' % wgpa,
+        "ugpa":         '%1.2f' % ugpa,
+        "service":      sections["service"][0],
+        "missing":      len(missing_list),
+        "low":          len(low_score_list),
+        "being_marked": len(being_marked_list),
+        "has_comment":  len(has_comment_list),
+        "stale":        "Showing earlier data for " + ", ".join(sections["stale"]) if sections.get("stale") else ""
     }
+    return tables, summary
+
+# Traces are recorded for students with "trace": true in config.json, and for any
+# request with ?trace=1
+def student_traced(student):
+    ReporterFactory.get_students()
+    return bool(ReporterFactory.students.get(student.lower(), {}).get("trace"))
+
+@app.route("/all")
+def all():
+    student = request.args.get('student')
+    traced = request.args.get('trace') == "1" or student_traced(student)
+    with tracing.tracing("all", traced, student=student.lower()) as trace:
+        start_time = time.time()
+        low_min_gain = int(request.args.get('min_gain'))
+        reporter = ReporterFactory.create(student)
+        reporter.load_assignments_if_stale(RECONCILE_SECONDS if reporter.events_applied else 0)
+        warmstart.save_if_changed(student.lower(), reporter)
+        search.update_in_background(student.lower(), reporter)
+        with tracing.span("snapshot"):
+            snapshot = snapshots.put(Snapshot.build(student.lower(), reporter))
+        snapshots.touch(student.lower())
+        load_time = time.time() - start_time
+        date = datetime.today().astimezone(reporter.timezone).strftime("%m/%d/%y %I:%M %p")
+        render_start = time.time()
+        with tracing.span("render"):
+            tables, summary = render_sections(student.lower(), snapshot.sections, low_min_gain)
+        render_time = time.time() - render_start
+        summary["time"] = int(load_time + 0.5)
+        summary["render"] = int(1000 * render_time + 0.5)
+        metrics.record("render", render_time)
+        trace_id = trace.id if trace else None
+        return render_template('all.html', student=student.capitalize(), date=date, summary=summary, version=snapshot.version, min_gain=low_min_gain, trace_id=trace_id, **tables)
+
+def server_sent_event(name, data):
+    return "event: {}\ndata: {}\n\n".format(name, json.dumps(data))
+
+# Pushes the sections of a dashboard that change after the snapshot version it was rendered
+# from. Every open dashboard of a student shares the one refresh run by `live`.
+@app.route("/stream/<student>")
+def stream(student):
+    student = student.lower()
+    if student not in ReporterFactory.get_students():
+        return "Unknown student {}".format(student), 404
+    version = int(request.args.get('version', 0))
+    low_min_gain = int(request.args.get('min_gain', 2))
+
+    def section_events():
+        seen = version
+        live.subscribe(student)
+        snapshots.touch(student)
+        try:
+            current = snapshots.get(student)
+            sent = render_sections(student, current.sections, low_min_gain) if current and current.version == seen else None
+            while True:
+                snapshot = snapshots.wait(student, seen, STREAM_KEEPALIVE_SECONDS)
+                if snapshot is None:
+                    yield ": keepalive\n\n"
+                    continue
+                tables, summary = render_sections(student, snapshot.sections, low_min_gain)
+                for name, table in tables.items():
+                    if sent is None or sent[0][name] != table:
+                        yield server_sent_event("section", {"name": name, "html": str(table)})
+                if sent is None or sent[1] != summary:
+                    yield server_sent_event("summary", summary)
+                sent = (tables, summary)
+                seen = snapshot.version
+        finally:
+            live.unsubscribe(student)
+
+    return Response(stream_with_context(section_events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Served from the last snapshot only, calendar clients polling it never reach Canvas
+@app.route("/ics/<student>")
+def calendar(student):
+    snapshot = snapshots.get(student.lower())
+    if snapshot is None:
+        return "No reports for {} yet".format(student), 404
+    response = make_response(calendar_feed.render(snapshot))
+    response.mimetype = "text/calendar"
+    response.set_etag(snapshot.etag)
+    response.last_modified = datetime.fromtimestamp(snapshot.taken_at, pytz.UTC)
+    return response.make_conditional(request)
+
+# Canvas Live Events or webhook payloads, one object or a list, see events.py
+@app.route("/events", methods=['POST'])
+def events():
+    if EVENT_SECRET:
+        if not hmac.compare_digest(request.headers.get("X-Event-Secret", ""), EVENT_SECRET):
+            return "Forbidden", 403
+    elif not EVENTS_INSECURE:
+        return "Events are off, set CCANVAS_EVENT_SECRET", 403
+    payload = request.get_json(force=True)
+    payloads = payload if isinstance(payload, list) else [payload]
+    loaded = {s: r for s, r in reporters.items() if r.loaded_at}
+    applied, changed = apply_events(loaded, payloads)
+    for student in changed:
+        snapshots.put(Snapshot.build(student, loaded[student]))
+        index = search.index_for(student)
+        if index.update(loaded[student]):
+            index.save()
+    return jsonify(received=len(payloads), applied=applied, students=sorted(changed))
+
+if FLEET_SHARDS:
+    ReporterFactory.get_students()
+    fleet = FleetScheduler(ReporterFactory.students, FLEET_SHARDS)
+    threading.Thread(target=fleet.run, name="fleet", daemon=True).start()
+    metrics.register("fleet", fleet.stats)
+
+# Answered from the persisted comment index alone; a loaded reporter also brings it up to date
+# in the background for the next search
+@app.route("/search")
+def search_comments():
+    student = request.args.get('student', '').lower()
+    if student not in ReporterFactory.get_students():
+        return "Unknown student {}".format(student), 404
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', '50')
+    if not limit.isdigit() or not 0 < int(limit) <= 500:
+        return "limit must be a number from 1 to 500", 400
+    start_time = time.time()
+    hits = search.index_for(student).search(query, int(limit)) if query else []
+    search_time = time.time() - start_time
+    metrics.record("search", search_time)
+    loaded = dict(reporters.items()).get(student)
+    if loaded is not None and loaded.loaded_at:
+        search.update_in_background(student, loaded)
+    results = render_table("search_hits", hits, lambda h: hit_row(student, h), "No matching comments")
+    return render_template('search.html', student=student, query=query, results=results, count=len(hits), ms=round(1000 * search_time, 1))
+
+@app.route("/traces")
+def trace_list():
+    return jsonify(tracing.traces.summaries())
 
-    return render_template('all.html', student=student.capitalize(), date=date, summary=summary, scores=scores, today=today, week=week, missing=missing, low_score=low_score, being_marked=being_marked, has_comment=has_comment)
+@app.route("/traces/<int:id>")
+def trace_download(id):
+    trace = tracing.traces.get(id)
+    if trace is None:
+        return "Trace not found", 404
+    response = make_response(tracing.to_json(trace))
+    response.mimetype = "application/json"
+    response.headers["Content-Disposition"] = "attachment; filename=trace-{}.json".format(id)
+    return response
 
+@app.route("/metrics")
+def show_metrics():
+    return jsonify(metrics.snapshot())
 
 
 if __name__ == "__main__":
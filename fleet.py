@@ -0,0 +1,209 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+from registry import ReporterRegistry
+from scheduler import Priority, request_priority
+from snapshot import Snapshot, snapshots
+
+# Refresh intervals: students nobody has looked at lately, students whose reports were
+# viewed within RECENT_USE, and students with unfinished work due within DUE_SOON
+IDLE_INTERVAL = 6 * 3600
+ACTIVE_INTERVAL = 15 * 60
+DUE_INTERVAL = 30 * 60
+RECENT_USE = 24 * 3600
+DUE_SOON = 24 * 3600
+
+# Delay before retrying students whose refresh crashed, e.g. with its worker process
+CRASH_RETRY = 60
+
+# Memory each worker process may keep warm reporters in, see worker_reporters
+WORKER_REPORTER_MB = int(os.environ.get("CCANVAS_WORKER_REPORTER_MB", 64))
+
+
+class RefreshResult(NamedTuple):
+    student: str
+    next_due: float
+    seconds: float
+    error: str
+
+
+# Reporters of the students sharded to this worker process, kept between refreshes while
+# they fit in WORKER_REPORTER_MB. One idle for two idle intervals has missed its refreshes
+# and is dropped too. A dropped reporter is built again, cold, on the student's next refresh.
+worker_configs = {}
+
+def build_worker_reporter(student):
+    from reporter import Reporter
+    return Reporter(worker_configs[student])
+
+worker_reporters = ReporterRegistry(build_worker_reporter, WORKER_REPORTER_MB * 1024 * 1024, 2 * IDLE_INTERVAL)
+
+# Runs in a pool process: reload one student and write their snapshot to the shared store
+def refresh_student(student, config):
+    start_time = time.time()
+    try:
+        with request_priority(Priority.Background):
+            worker_configs[student] = config
+            reporter = worker_reporters.get(student)
+            reporter.load_assignments()
+            snapshot = snapshots.put(Snapshot.build(student, reporter))
+        worker_reporters.evict()
+        now = time.time()
+        due = [row.due_date().timestamp() for row in snapshot.sections["today"] + snapshot.sections["week"] if row.status == "Not_Submitted" and row.due]
+        due = [d for d in due if d > now]
+        return RefreshResult(student, min(due) if due else None, time.time() - start_time, None)
+    except Exception as e:
+        return RefreshResult(student, None, time.time() - start_time, str(e))
+
+
+# Keeps every student's snapshot fresh with a pool of worker processes. Each student is
+# pinned to one single-process shard so its Reporter stays warm there. Students are due
+# again sooner when someone used their reports recently or work is due soon, first
+# refreshes are staggered evenly over one idle interval and later ones are jittered so
+# they stay spread out.
+class FleetScheduler:
+    def __init__(self, students, shards=4, in_flight_per_shard=2):
+        self.logger = logging.getLogger(__name__)
+        self.students = students
+        self.shards = [ProcessPoolExecutor(max_workers=1) for _ in range(shards)]
+        self.max_in_flight = shards * in_flight_per_shard
+        self.lock = threading.Lock()
+        self.queue = []
+        self.in_flight = {}
+        self.next_due = {}
+        self.completed = deque()
+        self.lags = deque(maxlen=1000)
+        self.failures = 0
+        self.stopped = threading.Event()
+        now = time.time()
+        spacing = IDLE_INTERVAL / max(1, len(students))
+        for i, student in enumerate(sorted(students, key=self.urgency)):
+            heapq.heappush(self.queue, (now + i * spacing, student))
+
+    def shard_index(self, student):
+        return zlib.crc32(student.encode()) % len(self.shards)
+
+    def shard(self, student):
+        return self.shards[self.shard_index(student)]
+
+    # A worker that dies breaks its pool for good, so the shard gets a new one. Every future
+    # on the broken pool fails, only the first replaces it.
+    def replace_shard(self, executor):
+        for i, shard in enumerate(self.shards):
+            if shard is executor:
+                self.shards[i] = ProcessPoolExecutor(max_workers=1)
+                executor.shutdown(wait=False)
+
+    # Students seen most recently go first in the initial stagger
+    def urgency(self, student):
+        seen = snapshots.last_seen(student)
+        return -seen if seen else 0
+
+    def interval(self, student, now):
+        interval = IDLE_INTERVAL
+        seen = snapshots.last_seen(student)
+        if seen and now - seen < RECENT_USE:
+            interval = ACTIVE_INTERVAL
+        due = self.next_due.get(student)
+        if due and due - now < DUE_SOON:
+            interval = min(interval, DUE_INTERVAL)
+        return interval * random.uniform(0.9, 1.1)
+
+    def dispatch(self, now):
+        with self.lock:
+            while self.queue and self.queue[0][0] <= now and len(self.in_flight) < self.max_in_flight:
+                due, student = heapq.heappop(self.queue)
+                self.lags.append(now - due)
+                executor = self.shard(student)
+                future = executor.submit(refresh_student, student, self.students[student])
+                self.in_flight[future] = (student, executor)
+
+    def collect(self, timeout):
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.time()
+        with self.lock:
+            for future in done:
+                student, executor = self.in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.failures += 1
+                    self.logger.error("Refresh of {} crashed: {!r}".format(student, e))
+                    if isinstance(e, BrokenProcessPool):
+                        self.replace_shard(executor)
+                    heapq.heappush(self.queue, (now + CRASH_RETRY, student))
+                    continue
+                if result.error:
+                    self.failures += 1
+                    self.logger.warning("Refresh of {} failed: {}".format(result.student, result.error))
+                self.next_due[result.student] = result.next_due
+                self.completed.append(now)
+                heapq.heappush(self.queue, (now + self.interval(result.student, now), result.student))
+
+    def run(self):
+        while not self.stopped.is_set():
+            now = time.time()
+            self.dispatch(now)
+            with self.lock:
+                next_time = self.queue[0][0] if self.queue else now + 1
+            timeout = min(1.0, max(0.0, next_time - now))
+            if self.in_flight:
+                self.collect(timeout)
+            else:
+                self.stopped.wait(timeout)
+
+    def stop(self):
+        self.stopped.set()
+        for shard in self.shards:
+            shard.shutdown(wait=False, cancel_futures=True)
+
+    # Throughput over the last minute and how late refreshes started compared to their due time
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            while self.completed and now - self.completed[0] > 60:
+                self.completed.popleft()
+            lags = sorted(self.lags)
+            return {
+                "students":          len(self.students),
+                "refreshed_per_min": len(self.completed),
+                "queued":            len(self.queue),
+                "overdue":           sum(1 for due, _ in self.queue if due <= now),
+                "in_flight":         len(self.in_flight),
+                "failures":          self.failures,
+                "lag_avg_s":         round(sum(lags) / len(lags), 1) if lags else 0,
+                "lag_max_s":         round(lags[-1], 1) if lags else 0
+            }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Keep every student\'s reports fresh')
+    parser.add_argument('--config', default='config.json', help='students and their Canvas credentials')
+    parser.add_argument('--shards', type=int, default=4, help='worker processes')
+    parser.add_argument('--report', type=int, default=60, help='seconds between statistics lines')
+    parser.add_argument('--loglevel', choices={'debug', 'info', 'warning', 'error', 'critical'}, default='warning', help="Set the logging level")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.getLevelName(args.loglevel.upper()))
+    with open(args.config) as json_file:
+        students = json.load(json_file)
+    fleet = FleetScheduler(students, args.shards)
+    threading.Thread(target=fleet.run, daemon=True).start()
+    try:
+        while True:
+            time.sleep(args.report)
+            print(json.dumps(fleet.stats()), flush=True)
+    except KeyboardInterrupt:
+        fleet.stop()
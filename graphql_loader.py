@@ -0,0 +1,141 @@
+import logging
+import time
+from types import SimpleNamespace
+import utils
+
+# Courses per GraphQL request, each aliased in the same query
+COURSES_PER_QUERY = 8
+
+# Canvas caps connections at 100 nodes per page
+PAGE_SIZE = 100
+
+ASSIGNMENT_FIELDS = """
+        pageInfo { hasNextPage endCursor }
+        nodes { _id name dueAt lockAt pointsPossible submissionTypes updatedAt assignmentGroupId }"""
+
+SUBMISSION_FIELDS = """
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          _id assignmentId score attempt submittedAt gradedAt state excused late missing
+        }"""
+
+GROUP_FIELDS = """
+        nodes { _id name groupWeight }"""
+
+
+def course_query(alias, course_id, user_id, assignments_after=None, submissions_after=None, groups=True):
+    parts = ['{}: course(id: "{}") {{'.format(alias, course_id), "_id"]
+    if assignments_after is not False:
+        after = ', after: "{}"'.format(assignments_after) if assignments_after else ""
+        parts.append("assignmentsConnection(first: {}{}) {{{}\n      }}".format(PAGE_SIZE, after, ASSIGNMENT_FIELDS))
+    if submissions_after is not False:
+        after = ', after: "{}"'.format(submissions_after) if submissions_after else ""
+        parts.append('submissionsConnection(first: {}{}, studentIds: ["{}"]) {{{}\n      }}'.format(PAGE_SIZE, after, user_id, SUBMISSION_FIELDS))
+    if groups:
+        parts.append("assignmentGroupsConnection {{{}\n      }}".format(GROUP_FIELDS))
+    parts.append("}")
+    return "\n      ".join(parts)
+
+# Converts GraphQL nodes to the attribute names and date format of the REST objects
+def rest_assignment(course_id, node):
+    return SimpleNamespace(
+        id=int(node["_id"]),
+        course_id=course_id,
+        name=node["name"],
+        due_at=utils.canvas_date(node["dueAt"]),
+        lock_at=utils.canvas_date(node["lockAt"]),
+        points_possible=node["pointsPossible"],
+        submission_types=node["submissionTypes"] or [],
+        updated_at=utils.canvas_date(node["updatedAt"]),
+        assignment_group_id=int(node["assignmentGroupId"]) if node["assignmentGroupId"] else None)
+
+# Comments are left out, as in the REST load, and fetched by the course when needed
+def rest_submission(node):
+    return SimpleNamespace(
+        id=int(node["_id"]),
+        assignment_id=int(node["assignmentId"]),
+        score=node["score"],
+        attempt=node["attempt"] or 0,
+        submitted_at=utils.canvas_date(node["submittedAt"]),
+        graded_at=utils.canvas_date(node["gradedAt"]),
+        workflow_state=node["state"],
+        excused=bool(node["excused"]),
+        late=bool(node["late"]),
+        missing=bool(node["missing"]))
+
+# Assignments with nothing submitted yet may have no submission node
+def unsubmitted(assignment_id):
+    return SimpleNamespace(id=None, assignment_id=assignment_id, score=None, attempt=0, submitted_at=None, graded_at=None,
+                           workflow_state="unsubmitted", excused=False, late=False, missing=False)
+
+def rest_group(node):
+    return SimpleNamespace(id=int(node["_id"]), name=node["name"], group_weight=node["groupWeight"] or 0)
+
+
+# Loads courses, assignment groups, assignments and the student's submissions through
+# Canvas GraphQL, a few courses per request, instead of three paginated REST calls per
+# course. Results go through Course.ingest() and the calculator like the
+# REST ones, so the reports cannot tell the loaders apart. Selected per student with
+# "loader": "graphql" in config.json.
+class GraphQLLoader:
+    def __init__(self, canvas):
+        self.logger = logging.getLogger(__name__)
+        self.canvas = canvas
+        self.queries = 0
+
+    def query(self, parts):
+        self.queries += 1
+        result = self.canvas.graphql("query {\n  " + "\n  ".join(parts) + "\n}")
+        if result.get("errors"):
+            raise RuntimeError("GraphQL errors: {}".format(result["errors"]))
+        return result["data"]
+
+    # Raw assignments, submissions by assignment id and groups for each course id
+    def fetch(self, courses, user):
+        found = {c.id: ([], {}, []) for c in courses}
+        pending = {c.id: (None, None, True) for c in courses}
+        while pending:
+            batch = list(pending.items())[:COURSES_PER_QUERY]
+            parts = [course_query("c{}".format(id), id, user.id, *cursors) for id, cursors in batch]
+            data = self.query(parts)
+            for id, (assignments_after, submissions_after, _) in batch:
+                del pending[id]
+                node = data["c{}".format(id)]
+                assignments, submissions, groups = found[id]
+                next_assignments = next_submissions = False
+                if assignments_after is not False:
+                    connection = node["assignmentsConnection"]
+                    assignments.extend(rest_assignment(id, a) for a in connection["nodes"])
+                    if connection["pageInfo"]["hasNextPage"]:
+                        next_assignments = connection["pageInfo"]["endCursor"]
+                if submissions_after is not False:
+                    connection = node["submissionsConnection"]
+                    for s in connection["nodes"]:
+                        submission = rest_submission(s)
+                        submissions[submission.assignment_id] = submission
+                    if connection["pageInfo"]["hasNextPage"]:
+                        next_submissions = connection["pageInfo"]["endCursor"]
+                if "assignmentGroupsConnection" in node:
+                    groups.extend(rest_group(g) for g in node["assignmentGroupsConnection"]["nodes"])
+                if next_assignments is not False or next_submissions is not False:
+                    pending[id] = (next_assignments, next_submissions, False)
+        return found
+
+    # Same result as Reporter.fetch_assignments: the valid assignments of the graded courses
+    def load(self, user, courses, calculator):
+        start_time = time.time()
+        queries = self.queries
+        found = self.fetch(courses, user)
+        assignments = {}
+        for course in courses:
+            raw_assignments, submissions, groups = found[course.id]
+            calculator.set_groups(course, course.filter_groups(groups))
+            for a in raw_assignments:
+                if a.id not in submissions:
+                    submissions[a.id] = unsubmitted(a.id)
+            raw_assignments.sort(key=lambda a: (a.due_at is None, a.due_at or ""))
+            course.commit(course.ingest(user, raw_assignments, submissions))
+            if course.is_valid:
+                assignments.update(course.assignments)
+        self.logger.info("GraphQL load of {} courses took {} queries and {}s".format(len(courses), self.queries - queries, time.time() - start_time))
+        return assignments
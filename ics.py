@@ -0,0 +1,82 @@
+import threading
+from datetime import datetime, timezone
+
+
+def ics_date(date):
+    return date.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def ics_text(text):
+    return str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+# Content lines longer than 75 octets are folded onto continuation lines starting with a space
+def fold(line):
+    data = line.encode()
+    if len(data) <= 75:
+        return line
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(data[:size].decode())
+        data = data[size:]
+    return "\r\n ".join(parts)
+
+
+# iCalendar feed of a student's due dates built from their snapshot. Each VEVENT is kept with
+# the row it came from, so a new snapshot only re-encodes the assignments that changed, and
+# the whole feed is reused while the snapshot etag is unchanged.
+class CalendarFeed:
+    def __init__(self, host="ccanvas"):
+        self.host = host
+        self.lock = threading.Lock()
+        self.events = {}
+        self.feeds = {}
+
+    def event(self, student, row, stamp):
+        events = self.events.setdefault(student, {})
+        cached = events.get(row.id)
+        if cached and cached[0] == row:
+            return cached[1]
+        lines = [
+            "BEGIN:VEVENT",
+            "UID:{}-{}@{}".format(student, row.id, self.host),
+            "DTSTAMP:" + stamp,
+            "DTSTART:" + ics_date(row.due_date()),
+            "SUMMARY:" + ics_text("{}: {} [{}]".format(row.course, row.name, row.status.replace("_", " "))),
+            "DESCRIPTION:" + ics_text("Possible gain {}%".format(row.possible_gain)),
+            "END:VEVENT"
+        ]
+        text = "\r\n".join(fold(line) for line in lines)
+        events[row.id] = (row, text)
+        return text
+
+    def render(self, snapshot):
+        with self.lock:
+            feed = self.feeds.get(snapshot.student)
+            if feed and feed[0] == snapshot.etag:
+                return feed[1]
+            stamp = ics_date(datetime.fromtimestamp(snapshot.taken_at, timezone.utc))
+            rows = {}
+            for section in ["today", "week"]:
+                for row in snapshot.sections.get(section, ()):
+                    if row.due:
+                        rows[row.id] = row
+            events = self.events.setdefault(snapshot.student, {})
+            for id in list(events):
+                if id not in rows:
+                    del events[id]
+            lines = [
+                "BEGIN:VCALENDAR",
+                "VERSION:2.0",
+                "PRODID:-//ccanvas//Canvas Reporter//EN",
+                "X-WR-CALNAME:" + ics_text(snapshot.student.capitalize() + " assignments")
+            ]
+            lines.extend(self.event(snapshot.student, row, stamp) for row in sorted(rows.values(), key=lambda r: r.due))
+            lines.append("END:VCALENDAR")
+            text = "\r\n".join(lines) + "\r\n"
+            self.feeds[snapshot.student] = (snapshot.etag, text)
+            return text
+
+
+calendar_feed = CalendarFeed()
@@ -0,0 +1,51 @@
+import logging
+import threading
+import time
+from scheduler import Priority, request_priority
+
+
+# Keeps the snapshots of students with open dashboards fresh. However many dashboards a
+# student has open, one background thread refreshes them every interval seconds, and it
+# stops once the last dashboard disconnects.
+class LiveRefresher:
+    def __init__(self, refresh, interval=120):
+        self.logger = logging.getLogger(__name__)
+        self.refresh = refresh
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.threads = {}
+
+    def subscribe(self, student):
+        with self.lock:
+            self.subscribers[student] = self.subscribers.get(student, 0) + 1
+            if student not in self.threads:
+                thread = threading.Thread(target=self.run, args=(student,), name="live-" + student, daemon=True)
+                self.threads[student] = thread
+                thread.start()
+
+    def unsubscribe(self, student):
+        with self.lock:
+            self.subscribers[student] -= 1
+
+    def watching(self, student):
+        with self.lock:
+            if self.subscribers.get(student, 0) > 0:
+                return True
+            del self.threads[student]
+            return False
+
+    def run(self, student):
+        with request_priority(Priority.Background):
+            while True:
+                time.sleep(self.interval)
+                if not self.watching(student):
+                    return
+                try:
+                    self.refresh(student)
+                except Exception as e:
+                    self.logger.warning("Live refresh for {} failed: {}".format(student, e))
+
+    def stats(self):
+        with self.lock:
+            return {"students": len(self.threads), "subscribers": sum(self.subscribers.values())}
@@ -0,0 +1,32 @@
+import threading
+
+
+# Process-wide counters and timings, served as JSON by the /metrics route. Components with
+# their own statistics register a callable that returns them.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.sources = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            count, total, _ = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + seconds, seconds)
+
+    def register(self, name, stats):
+        with self.lock:
+            self.sources[name] = stats
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for name, (count, total, last) in self.timings.items():
+                result[name] = {"count": count, "last_ms": round(1000 * last, 2), "avg_ms": round(1000 * total / count, 2)}
+            sources = list(self.sources.items())
+        for name, stats in sources:
+            result[name] = stats()
+        return result
+
+
+metrics = Metrics()
@@ -0,0 +1,138 @@
+import logging
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from scheduler import RequestScheduler
+from singleflight import SingleFlight
+
+# Shared by every reporter, so not counted against any one of them
+shared_types = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, logging.Logger, RequestScheduler)
+
+
+# Bytes reachable from obj, following containers and instance attributes, each object counted once
+def deep_size(obj):
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, shared_types):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            items = list(o.items())
+            pending.extend(k for k, _ in items)
+            pending.extend(v for _, v in items)
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            pending.extend(list(o))
+        if hasattr(o, "__dict__"):
+            pending.append(o.__dict__)
+        for name in getattr(type(o), "__slots__", ()):
+            if hasattr(o, name):
+                pending.append(getattr(o, name))
+    return size
+
+
+class Entry:
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self.size = 0
+        self.sized_at = None
+        self.used_at = time.time()
+
+
+# Reporters by student, least recently used first. Whole reporters are dropped once idle
+# for longer than ttl seconds or when their total size goes over max_bytes; the next
+# request for that student builds a fresh one. A reporter is re-measured after each load.
+class ReporterRegistry:
+    def __init__(self, build, max_bytes=256 * 1024 * 1024, ttl=6 * 3600, sweep_interval=60):
+        self.logger = logging.getLogger(__name__)
+        self.build = build
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.swept_at = time.time()
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.builds = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, student):
+        with self.lock:
+            entry = self.entries.get(student)
+            if entry is not None:
+                self.entries.move_to_end(student)
+                entry.used_at = time.time()
+                self.hits += 1
+                sweep = entry.used_at - self.swept_at > self.sweep_interval
+            else:
+                self.misses += 1
+        if entry is not None:
+            if sweep:
+                self.evict()
+            return entry.reporter
+        # Concurrent first requests for a student share one Canvas bootstrap
+        return self.builds.do(student, self.add, student)
+
+    def add(self, student):
+        with self.lock:
+            entry = self.entries.get(student)
+            if entry is not None:
+                return entry.reporter
+        entry = Entry(self.build(student))
+        with self.lock:
+            self.entries[student] = entry
+        self.evict()
+        return entry.reporter
+
+    # Loaded reporters by student, without counting as use
+    def items(self):
+        with self.lock:
+            return [(student, entry.reporter) for student, entry in self.entries.items()]
+
+    def measure(self):
+        with self.lock:
+            stale = [entry for entry in self.entries.values() if entry.sized_at != entry.reporter.loaded_at]
+        for entry in stale:
+            loaded_at = entry.reporter.loaded_at
+            try:
+                entry.size = deep_size(entry.reporter)
+                entry.sized_at = loaded_at
+            except RuntimeError:
+                # Changed while being walked, measured again next time
+                pass
+
+    def evict(self):
+        self.measure()
+        now = time.time()
+        with self.lock:
+            self.swept_at = now
+            total = sum(entry.size for entry in self.entries.values())
+            for student, entry in list(self.entries.items()):
+                if now - entry.used_at <= self.ttl and total <= self.max_bytes:
+                    continue
+                # Always keep the most recently used reporter
+                if len(self.entries) == 1:
+                    break
+                del self.entries[student]
+                total -= entry.size
+                self.evictions += 1
+                self.logger.info("Evicted reporter for {} ({} bytes)".format(student, entry.size))
+
+    def stats(self):
+        self.evict()
+        with self.lock:
+            return {
+                "reporters": len(self.entries),
+                "bytes":     sum(entry.size for entry in self.entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits":      self.hits,
+                "misses":    self.misses,
+                "evictions": self.evictions,
+                "sizes":     {student: entry.size for student, entry in self.entries.items()}
+            }
@@ -1,25 +1,57 @@
-import sys
-import os
-import datetime
 import pytz
 import json
-import io
-import urllib
+import os
 import logging
+import threading
 import time
 import concurrent.futures
-from enum import Enum
-from typing import NamedTuple
-from types import SimpleNamespace
-from canvasapi import Canvas, exceptions
+from canvasapi import Canvas
 from datetime import datetime
 from datetime import timedelta
-from datetime import date as datetime_date
-from course import Course, CourseScore
-from assignment import Assignment, AssignmentStatus, SubmissionStatus
+from typing import NamedTuple
+from course import Course, CourseAssignments, CourseScore
+from catalog import catalogs
+from assignment import Announcement, Assignment, AssignmentStatus, SubmissionStatus
 from weighting import WeightedScoreCalculator
+from graphql_loader import GraphQLLoader
+from duedates import DueDateIndex
+from scheduler import scheduler, submit
+from singleflight import SingleFlight
+import tracing
 import utils
-import inspect
+
+# How far back the announcements report looks
+ANNOUNCEMENT_WINDOW = timedelta(hours=12)
+
+class TermScores(NamedTuple):
+    term: str
+    scores: list
+    wpoints: float
+    upoints: float
+
+def average_scores(term, scores):
+    if not scores:
+        return TermScores(term, scores, 0.0, 0.0)
+    return TermScores(term, scores, sum(s.wpoints for s in scores) / len(scores), sum(s.upoints for s in scores) / len(scores))
+
+# Students without a "timezone" in config.json
+DEFAULT_TIMEZONE = "US/Pacific"
+
+# A course load still running after COURSE_HEDGE_SECONDS gets a second attempt, and courses
+# with no result after COURSE_DEADLINE_SECONDS keep their last good data for this load
+COURSE_HEDGE_SECONDS = float(os.environ.get("CCANVAS_COURSE_HEDGE", 4))
+COURSE_DEADLINE_SECONDS = float(os.environ.get("CCANVAS_COURSE_DEADLINE", 10))
+
+# Loads in progress, keyed by Canvas user and term, shared by every Reporter in the process
+loads = SingleFlight()
+
+# One lock per Canvas user around the read-modify-write of their announcement cache
+announcement_locks = {}
+announcement_locks_lock = threading.Lock()
+
+def announcement_lock(user_id):
+    with announcement_locks_lock:
+        return announcement_locks.setdefault(user_id, threading.Lock())
 
 # Examples
 # Physics submitted      https://cchs.instructure.com/courses/5347/assignments/160100/submissions/5573
@@ -30,44 +62,247 @@ class Reporter:
     def __init__(self, config, term=None):
         self.logger = logging.getLogger(__name__)
         self.logger.info("Config: {}".format(config))
-        self.canvas = Canvas(config["url"], config["key"])
-        self.user = self.canvas.get_user('self')
-        self.term = term
-        self.courses = {}
-        enrollments = self.user.get_enrollments(state=["current_and_concluded"])
+        self.connect(config)
+        self.init_state(term, config.get("timezone", DEFAULT_TIMEZONE))
         start_time = time.time()
+        # Scores come with the course list (total_scores), so enrollments are not fetched
         if self.term is None:
-            for course in self.user.get_courses(enrollment_state="active", include=["total_scores", "term"]):
-                enrollment_result = [e for e in enrollments if e.course_id == course.id]
-                enrollment = enrollment_result[0] if enrollment_result else None
+            for course in self.canvas.get_courses(enrollment_state="active", include=["total_scores", "term"]):
                 #print(f"{course.id}, {course.name}, {course.term['name']}, {enrollment.grades.get('current_score')}")
-                self.courses[course.id] = Course(course, enrollment)
+                self.courses[course.id] = Course(course, catalog=self.catalog)
+            now = datetime.today().replace(tzinfo=pytz.UTC)
+            for id in list(self.courses):
+                if not self.courses[id].is_current(now):
+                    del self.courses[id]
         else:
             self.term = self.term.replace('_', ' ')
-            all_courses = self.user.get_courses(include=["total_scores", "term"])
-            for c in all_courses:
-                if c.term.get('name') == self.term:
-                    self.courses[c.id] = Course(c)
+            for course in self.term_index().get(self.term, []):
+                self.courses[course.id] = course
         self.logger.info("get_courses took {}s".format(time.time() - start_time))
-        now = datetime.today().replace(tzinfo=pytz.UTC)
-        for id in list(self.courses):
-            if not self.courses[id].is_current(now):
-                del self.courses[id]
         self.calculator = WeightedScoreCalculator(self.courses)
 
-    def get_assignments(self, user, course):
-        return course.get_assignments(user)
+    # Canvas connection only, no API calls are made
+    def connect(self, config, canvas=None):
+        self.config = config
+        self.canvas = canvas if canvas else Canvas(config["url"], config["key"])
+        scheduler.attach(self.canvas)
+        self.loader = GraphQLLoader(self.canvas) if config.get("loader") == "graphql" else None
+        self.catalog = catalogs.get(config["url"])
 
-    def load_assignments(self):
+    def init_state(self, term, timezone):
+        self.timezone = pytz.timezone(timezone)
+        self._user = None
+        self.user_lock = threading.Lock()
+        self.terms = None
+        self.terms_lock = threading.Lock()
+        self.term = term
+        self.courses = {}
         self.assignments = {}
-        start_time = time.time()
+        self.loaded_at = None
+        self.needs_reload = False
+        self.events_applied = 0
+        self.due_index = None
+        self.reconciling = False
+        self.saved_at = None
+
+    # A Reporter over courses already loaded by other means, with no Canvas connection.
+    # Used by benchmark.py to time the reports on synthetic data.
+    @classmethod
+    def offline(cls, user, courses, timezone=DEFAULT_TIMEZONE):
+        reporter = cls.__new__(cls)
+        reporter.logger = logging.getLogger(__name__)
+        reporter.config = None
+        reporter.canvas = None
+        reporter.loader = None
+        reporter.catalog = catalogs.get()
+        reporter.init_state(None, timezone)
+        reporter._user = user
+        reporter.courses = courses
+        reporter.calculator = WeightedScoreCalculator(courses)
+        for course in courses.values():
+            if course.is_valid:
+                reporter.assignments.update(course.assignments)
+        reporter.loaded_at = time.time()
+        return reporter
+
+    # Every course the student has taken, grouped by term name, fetched once
+    def term_index(self):
+        with self.terms_lock:
+            if self.terms is None:
+                terms = {}
+                for c in self.canvas.get_courses(include=["total_scores", "term"]):
+                    course = Course(c, catalog=self.catalog)
+                    terms.setdefault(course.term_name, []).append(course)
+                self.terms = terms
+            return self.terms
+
+    # Course scores for one term. Finished terms never change so they are cached on disk.
+    def get_term_scores(self, term, courses):
+        now = datetime.today().replace(tzinfo=pytz.UTC)
+        finished = all(course.is_finished(now) for course in courses)
+        path = utils.cache_path("terms", str(self.user.id), utils.safe_filename(term) + ".json")
+        if finished and os.path.exists(path):
+            with open(path) as json_file:
+                return average_scores(term, [CourseScore(*score) for score in json.load(json_file)])
+        graded = {course.id: course for course in courses if course.is_valid}
+        calculator = WeightedScoreCalculator(graded)
+        assignments = {}
+        for course in graded.values():
+            if not course.has_grade:
+                calculator.load_groups(course)
+                assignments.update(course.get_assignments(self.user))
+        calculator.update(assignments, now)
+        scores = []
+        for course in graded.values():
+            course_score = course.get_score(calculator)
+            if course_score and course_score not in scores:
+                scores.append(course_score)
+        if finished:
+            with open(path, "w") as json_file:
+                json.dump(scores, json_file)
+        return average_scores(term, scores)
+
+    # Per-term grades, oldest first, plus the cumulative GPA over every graded course
+    def get_term_history(self):
+        terms = self.term_index()
+        def term_end(term):
+            return terms[term][0].raw.term.get("end_at") or "9999"
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            for course in self.courses.values():
-                futures.append(executor.submit(self.get_assignments, user=self.user, course=course))
-            for future in concurrent.futures.as_completed(futures):
-                self.assignments.update(future.result())
+            futures = [submit(executor, self.get_term_scores, term, terms[term]) for term in sorted(terms, key=term_end)]
+            history = [future.result() for future in futures]
+        history = [term for term in history if term.scores]
+        cumulative = average_scores("Cumulative", [score for term in history for score in term.scores])
+        return history, cumulative
+
+    # Only fetched when a report needs the student's id or name
+    @property
+    def user(self):
+        with self.user_lock:
+            if self._user is None:
+                self._user = self.canvas.get_current_user()
+            return self._user
+
+    # Graded courses feed the reports, the Service course is ingested for service hours
+    def get_assignments(self, user, course):
+        self.calculator.load_groups(course)
+        assignments = course.load_assignments(user)
+        return assignments if course.is_valid else {}
+
+    # include selects the courses to load, so reports only fetch the data they read
+    def load_assignments(self, include=None):
+        courses = [c for c in self.courses.values() if (c.is_valid or c.is_service) and (include is None or include(c))]
+        if not courses:
+            self.assignments = {}
+            return
+        key = (self.canvas._Canvas__requester.base_url, self.user.id, self.term, tuple(sorted(c.id for c in courses)))
+        if loads.in_flight(key):
+            self.logger.info("Sharing in-flight load for user {}".format(self.user.id))
+        with tracing.span("load", courses=[c.name for c in courses]):
+            shared = loads.do(key, self.fetch_shared, courses)
+        self.assignments = self.adopt(courses, shared)
+        self.loaded_at = time.time()
+        # Stale courses are tried again on the next request
+        self.needs_reload = any(c.stale for c in courses)
+
+    # Full reloads are only a reconciliation fallback once change events are arriving
+    def load_assignments_if_stale(self, max_age):
+        if self.reconciling:
+            return
+        if self.needs_reload or self.loaded_at is None or time.time() - self.loaded_at >= max_age:
+            self.load_assignments()
+
+    # Replaces the courses and assignments with a fresh load from Canvas, e.g. in the
+    # background after a warm start. Reports keep reading the old ones until it is done.
+    def reconcile(self):
+        self.reconciling = True
+        try:
+            fresh = Reporter(self.config, self.term)
+            fresh._user = self._user
+            fresh.load_assignments()
+            self.courses, self.calculator = fresh.courses, fresh.calculator
+            self.timezone = fresh.timezone
+            self.assignments = fresh.assignments
+            self.loaded_at = fresh.loaded_at
+            self.needs_reload = fresh.needs_reload
+        finally:
+            self.reconciling = False
+
+    # The leader of a shared load returns what each course loaded, keyed by course id, so
+    # Reporters that joined it can commit the same assignments into their own courses
+    def fetch_shared(self, courses):
+        self.fetch_assignments(courses)
+        return {c.id: CourseAssignments(c.assignments, c.invalid_assignments, c.comment_candidates) for c in courses if not c.stale}
+
+    # Commits a shared load into courses that did not run it; courses it missed keep their data
+    def adopt(self, courses, shared):
+        assignments = {}
+        for course in courses:
+            loaded = shared.get(course.id)
+            if loaded is None:
+                course.mark_stale()
+            elif course.assignments is not loaded.valid:
+                course.commit(loaded)
+            if course.is_valid:
+                assignments.update(course.assignments)
+        return assignments
+
+    def fetch_assignments(self, courses):
+        if self.loader:
+            return self.loader.load(self.user, courses, self.calculator)
+        start_time = time.time()
+        hedge_time = start_time + COURSE_HEDGE_SECONDS
+        deadline = start_time + COURSE_DEADLINE_SECONDS
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * len(courses))
+        attempts = {submit(executor, self.fetch_course, course): course for course in courses}
+        pending = set(attempts)
+        hedged = set()
+        loaded = set()
+
+        def hedge(course):
+            hedged.add(course.id)
+            future = submit(executor, self.fetch_course, course)
+            attempts[future] = course
+            pending.add(future)
+
+        while pending and time.time() < deadline:
+            next_time = hedge_time if time.time() < hedge_time else deadline
+            done, _ = concurrent.futures.wait(pending, timeout=max(0, next_time - time.time()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                course = attempts[future]
+                if course.id in loaded:
+                    continue
+                try:
+                    course.commit(future.result())
+                    loaded.add(course.id)
+                except Exception as e:
+                    self.logger.warning("Loading {} failed: {}".format(course.name, e))
+                    if course.id not in hedged:
+                        hedge(course)
+            if time.time() >= hedge_time:
+                for course in {attempts[f].id: attempts[f] for f in pending}.values():
+                    if course.id not in hedged and course.id not in loaded:
+                        self.logger.info("Hedging slow load of {}".format(course.name))
+                        tracing.event("load.hedge", course=course.name)
+                        hedge(course)
+            pending = {f for f in pending if attempts[f].id not in loaded}
+        # Stragglers finish in the background and their results are dropped
+        executor.shutdown(wait=False)
+        assignments = {}
+        for course in courses:
+            if course.id not in loaded:
+                self.logger.warning("{} not loaded within {}s, using earlier data".format(course.name, COURSE_DEADLINE_SECONDS))
+                course.mark_stale()
+            if course.is_valid:
+                assignments.update(course.assignments)
         self.logger.info("load_assignments took {}s".format(time.time() - start_time))
+        return assignments
+
+    # One attempt at loading a course, committed by fetch_assignments if it is first in
+    def fetch_course(self, course):
+        with tracing.span("load.course", course=course.name):
+            self.calculator.load_groups(course)
+            return course.fetch_assignments(self.user)
 
     def load_assignments_serial(self):
         self.assignments = {}
@@ -79,6 +314,59 @@ class Reporter:
             #self.logger.info("get_assignments({}) took {} {}".format(course.name, time.time(), start_time))
         self.logger.info("load_assignments took {}s".format(time.time() - start_time))
 
+    # Batch load the comments reports may read, one request per course in parallel
+    def prefetch_comments(self):
+        courses = [c for c in self.courses.values() if c.comment_candidates]
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [submit(executor, course.load_submission_comments) for course in courses]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+    def find_assignment(self, id):
+        for course in self.courses.values():
+            assignment = course.find_assignment(id)
+            if assignment:
+                return course, assignment
+        return None, None
+
+    def find_submission(self, submission_id):
+        for course in self.courses.values():
+            for assignment in list(course.assignments.values()) + list(course.invalid_assignments.values()):
+                if getattr(assignment.submission, "id", None) == submission_id:
+                    return course, assignment
+        return None, None
+
+    # Applies a Canvas change event (see events.py) to the cached assignments and the
+    # calculator's totals. Returns False when the event is for something not loaded yet,
+    # which is left to the next reconciliation load.
+    def apply_event(self, event):
+        if event.assignment_id is not None:
+            course, assignment = self.find_assignment(event.assignment_id)
+        else:
+            course, assignment = self.find_submission(event.submission_id)
+        if assignment is None:
+            if event.name == "assignment_updated" and event.course_id in self.courses:
+                self.needs_reload = True
+            return False
+        if event.assignment:
+            assignment.update_assignment(event.assignment)
+        if event.submission:
+            assignment.update_submission(event.submission)
+        if event.comment:
+            comment = dict(event.comment)
+            comment["author_name"] = self.user.name if comment.pop("author_id") == self.user.id else "Teacher"
+            assignment.add_comment(comment)
+        course.reindex(assignment)
+        assignments = dict(self.assignments)
+        assignments.pop(assignment.id, None)
+        if course.is_valid and assignment.is_valid:
+            assignments[assignment.id] = assignment
+        self.assignments = assignments
+        self.calculator.update(self.assignments, datetime.today().astimezone(self.timezone))
+        self.events_applied += 1
+        self.logger.info("Applied {} to {} {}".format(event.name, course.name, assignment.get_name()))
+        return True
+
     def get_assignment(self, id):
         self.logger.info("Searching {} assignments for id {}".format(len(self.assignments), id))
         assignment = self.assignments.get(id)
@@ -87,7 +375,7 @@ class Reporter:
         return assignment
 
     def get_course_scores(self):
-        today = datetime.today().astimezone(pytz.timezone('US/Pacific'))
+        today = datetime.today().astimezone(self.timezone)
         self.calculator.update(self.assignments, today)
         scores = []
         for course in self.courses.values():
@@ -115,43 +403,53 @@ class Reporter:
         return int(total / len(scores) + 0.5)
 
 
+    def submission_status(self, assignment):
+        if assignment.is_graded():
+            return SubmissionStatus.Marked
+        elif not assignment.can_submit():
+            return SubmissionStatus.External
+        elif assignment.is_submitted():
+            return SubmissionStatus.Submitted
+        else:
+            return SubmissionStatus.Not_Submitted
+
+    # Due date index of the current assignments, rebuilt when they are replaced
+    def due_dates(self):
+        index = self.due_index
+        if index is None or not index.is_current(self.assignments, self.timezone):
+            index = self.due_index = DueDateIndex(self.assignments, self.timezone)
+        return index
+
     def check_calendar(self, start, end):
         status_list = []
         self.calculator.update(self.assignments, end)
-        for _, assignment in self.assignments.items():
-            due_date = assignment.get_due_date()
-            if (due_date > start) and (due_date < end) and assignment.get_points_possible() > 0:
+        self.prefetch_comments()
+        for assignment in self.due_dates().between(start, end):
+            if assignment.get_points_possible() > 0:
+                assignment.status = self.submission_status(assignment)
                 assignment.possible_gain = self.calculator.gain(assignment)
                 status_list.append(AssignmentStatus(assignment))
         return status_list
 
     def check_daily_course_submissions(self, date):
-        date = date.astimezone(pytz.timezone('US/Pacific'))
+        date = date.astimezone(self.timezone)
         self.calculator.update(self.assignments, date)
+        self.prefetch_comments()
         status_list = []
-        for assignment in self.assignments.values():
-            _, is_due_on_date = assignment.is_due(date)
-            # print("{} {} {}".format(assignment.get_name(), assignment.get_due_date().date(), date.date()))
-            if is_due_on_date:
-                if assignment.is_graded():
-                    state = SubmissionStatus.Marked
-                elif not assignment.can_submit():
-                    state = SubmissionStatus.External
-                elif assignment.is_submitted():
-                    state = SubmissionStatus.Submitted
-                else:
-                    state = SubmissionStatus.Not_Submitted
-                assignment.status = state
-                assignment.possible_gain = self.calculator.gain(assignment)
-                status_list.append(AssignmentStatus(assignment))
+        for assignment in self.due_dates().on_day(date):
+            assignment.status = self.submission_status(assignment)
+            assignment.possible_gain = self.calculator.gain(assignment)
+            status_list.append(AssignmentStatus(assignment))
         return status_list
 
     def check_course_assignments(self, end_date):
+        trace = tracing.active()
         report = []
         self.calculator.update(self.assignments, end_date)
+        self.prefetch_comments()
         for id, assignment in self.assignments.items():
             #group_id = assignment.get_group()
-            if assignment.is_valid and self.calculator.includes_assignment(assignment) and (assignment.get_due_date().astimezone(pytz.timezone('US/Pacific')) < end_date):
+            if assignment.is_valid and self.calculator.includes_assignment(assignment) and (assignment.get_due_date().astimezone(self.timezone) < end_date):
             #if assignment.is_valid and (group_id in self.group_max) and (assignment.get_due_date().astimezone(pytz.timezone('US/Pacific')) < end_date):
                 status = None
                 possible_gain = self.calculator.gain(assignment)
@@ -165,12 +463,14 @@ class Reporter:
                         status = SubmissionStatus.Low_Score
                 elif assignment.is_being_marked():
                     status = SubmissionStatus.Being_Marked
-                if assignment.submission_comments and assignment.get_score() < 100:
+                if assignment.get_score() < 100 and assignment.submission_comments:
                     last_comment = assignment.submission_comments[-1]
                     if last_comment.author not in self.user.name:
                         if not assignment.get_submission_date() or last_comment.date > assignment.get_submission_date():
                             status = SubmissionStatus.Has_Comment
                             # print("{} {} {}".format(last_comment.text, last_comment.date, assignment.get_score()))
+                if trace:
+                    trace.event("classify", course=assignment.get_course_name(), assignment=id, name=assignment.get_name(), status=status.name if status else None, gain=possible_gain)
                 if status:
                     assignment.status = status
                     assignment.possible_gain = possible_gain
@@ -181,21 +481,20 @@ class Reporter:
 
 
     def run_daily_submission_report(self, date):
-        end_of_today = date.astimezone(pytz.timezone('US/Pacific')).replace(hour=23, minute=59)
+        end_of_today = date.astimezone(self.timezone).replace(hour=23, minute=59)
         # print(end_of_today)
         return self.check_daily_course_submissions(end_of_today)
 
 
     def run_calendar_report(self, date):
-        start = date.astimezone(pytz.timezone('US/Pacific')).replace(hour=23, minute=59)
+        start = date.astimezone(self.timezone).replace(hour=23, minute=59)
         end = start + timedelta(days=7)
-        calendar = self.check_calendar(start, end)
-        return(sorted(calendar, key=lambda a: a.due_date))
+        return self.check_calendar(start, end)
 
     def run_assignment_report(self, filter, min_gain):
         start_time = time.time()
         filtered_report = []
-        yesterday = datetime.today().astimezone(pytz.timezone('US/Pacific')).replace(hour=0, minute=0)
+        yesterday = datetime.today().astimezone(self.timezone).replace(hour=0, minute=0)
         Assignment.comments_loaded = 0
         assignments = self.check_course_assignments(yesterday)
         for assignment in assignments:
@@ -210,16 +509,48 @@ class Reporter:
         return filtered_report
 
 
-    def is_valid_assignment_group(self, group_name):
-        for name in ["Attendance", "Imported Assignments", "Extra", "Final"]:
-            if name in group_name:
-                return False
+    def is_useful_announcement(self, title):
+        if title.startswith("****"):
+            return False
+        elif title.startswith("Attendance"):
+            return False
         return True
 
+    # Announcements for every current course come from one paged request. The posted_at of
+    # the newest one seen is kept as a watermark with the cached announcements, so each call
+    # only fetches what was posted since.
+    def get_announcements(self):
+        with announcement_lock(self.user.id):
+            path = utils.cache_path("announcements", str(self.user.id) + ".json")
+            cache = {"watermark": None, "announcements": []}
+            if os.path.exists(path):
+                with open(path) as json_file:
+                    cache = json.load(json_file)
+            now = datetime.today().replace(tzinfo=pytz.UTC)
+            start = utils.canvas_date((now - ANNOUNCEMENT_WINDOW).isoformat())
+            watermark = max(cache["watermark"] or start, start)
+            announcements = [a for a in cache["announcements"] if a[3] >= start]
+            context_codes = ["course_" + str(id) for id in self.courses]
+            if context_codes:
+                for a in self.canvas.get_announcements(context_codes=context_codes, start_date=watermark, end_date=utils.canvas_date(now.isoformat())):
+                    posted_at = utils.canvas_date(a.posted_at)
+                    course = self.courses.get(int(a.context_code[7:]))
+                    if posted_at <= watermark or not course:
+                        continue
+                    cache["watermark"] = max(cache["watermark"] or posted_at, posted_at)
+                    if self.is_useful_announcement(a.title):
+                        announcements.append([course.name, a.title, a.message, posted_at])
+            cache["announcements"] = announcements
+            with open(path + ".tmp", "w") as json_file:
+                json.dump(cache, json_file)
+            os.replace(path + ".tmp", path)
+        announcements = [Announcement(course, title, message, utils.convert_date(date)) for course, title, message, date in announcements]
+        return sorted(announcements, key=lambda a: a.date, reverse=True)
+
     def get_remaining_service_hours(self):
         default_hours = 10
         for course in self.courses.values():
-            if "Service" in course.raw.name:
+            if course.is_service:
                 self.logger.info("Christian service term = {}".format(course.term))
                 assignments = course.get_assignments(self.user, get_invalid=True)
                 for _, assignment in assignments.items():
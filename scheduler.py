@@ -0,0 +1,165 @@
+import contextlib
+import contextvars
+import hashlib
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from enum import IntEnum
+from canvasapi.exceptions import RateLimitExceeded
+
+
+# Seconds a Canvas request may wait to connect or between bytes of the response. canvasapi
+# sets no timeout, so without one a hung request holds its thread (and slot) indefinitely.
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("CCANVAS_REQUEST_TIMEOUT", 30))
+
+
+class Priority(IntEnum):
+    Interactive = 0
+    Background = 1
+
+
+# Priority of Canvas calls made from the current context, see request_priority()
+current_priority = contextvars.ContextVar("canvas_priority", default=Priority.Interactive)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+# Submit work to an executor so the task's Canvas calls keep the caller's priority
+def submit(executor, fn, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Every Canvas API call in the process goes through here. Canvas meters each access token
+# with a leaky bucket and reports what is left in X-Rate-Limit-Remaining, so concurrency per
+# token shrinks from max_concurrency to min_concurrency as that quota falls from high_quota
+# to low_quota. Calls throttled anyway are retried with jittered exponential backoff, and
+# queued interactive calls always go before background ones.
+class RequestScheduler:
+    def __init__(self, max_concurrency=8, min_concurrency=1, low_quota=100, high_quota=500, max_retries=5, backoff=1.0, max_backoff=30.0):
+        self.logger = logging.getLogger(__name__)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.low_quota = low_quota
+        self.high_quota = high_quota
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.condition = threading.Condition()
+        self.tickets = itertools.count()
+        self.waiting = {}
+        self.active = {}
+        self.remaining = {}
+        self.requests = 0
+        self.retries = 0
+        self.cost = 0.0
+
+    def attach(self, canvas):
+        requester = canvas._Canvas__requester
+        if getattr(requester, "scheduler", None) is self:
+            return
+        key = hashlib.sha1(requester.access_token.encode()).hexdigest()[:8]
+        request = requester.request
+
+        def scheduled_request(*args, **kwargs):
+            return self.call(key, request, *args, **kwargs)
+
+        requester.request = scheduled_request
+        requester.scheduler = self
+        session_request = requester._session.request
+
+        def timed_request(*args, **kwargs):
+            kwargs.setdefault("timeout", REQUEST_TIMEOUT_SECONDS)
+            return session_request(*args, **kwargs)
+
+        requester._session.request = timed_request
+
+    def call(self, key, request, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire(key, current_priority.get())
+            try:
+                response = request(*args, **kwargs)
+                self.observe(key, response)
+                return response
+            except RateLimitExceeded:
+                with self.condition:
+                    self.remaining[key] = 0
+                    self.retries += 1
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                self.release(key)
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            self.logger.warning("Canvas rate limit exceeded, retry {} in {:.1f}s".format(attempt + 1, delay))
+            time.sleep(delay)
+            attempt += 1
+
+    def limit(self, key):
+        remaining = self.remaining.get(key)
+        if remaining is None or remaining >= self.high_quota:
+            return self.max_concurrency
+        if remaining <= self.low_quota:
+            return self.min_concurrency
+        fraction = (remaining - self.low_quota) / (self.high_quota - self.low_quota)
+        return self.min_concurrency + int(fraction * (self.max_concurrency - self.min_concurrency))
+
+    def can_start(self, key):
+        return sum(self.active.values()) < self.max_concurrency and self.active.get(key, 0) < self.limit(key)
+
+    # The first queued call (by priority, then arrival) that has capacity goes next
+    def next_ticket(self):
+        for ticket, (priority, key) in sorted(self.waiting.items(), key=lambda w: (w[1][0], w[0])):
+            if self.can_start(key):
+                return ticket
+        return None
+
+    def acquire(self, key, priority):
+        with self.condition:
+            ticket = next(self.tickets)
+            self.waiting[ticket] = (priority, key)
+            while self.next_ticket() != ticket:
+                self.condition.wait()
+            del self.waiting[ticket]
+            self.active[key] = self.active.get(key, 0) + 1
+            self.requests += 1
+            self.condition.notify_all()
+
+    def release(self, key):
+        with self.condition:
+            self.active[key] -= 1
+            self.condition.notify_all()
+
+    def observe(self, key, response):
+        remaining = response.headers.get("X-Rate-Limit-Remaining")
+        cost = response.headers.get("X-Request-Cost")
+        with self.condition:
+            if remaining is not None:
+                self.remaining[key] = float(remaining)
+            if cost is not None:
+                self.cost += float(cost)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "requests":  self.requests,
+                "retries":   self.retries,
+                "cost":      round(self.cost, 2),
+                "active":    sum(self.active.values()),
+                "waiting":   len(self.waiting),
+                "remaining": dict(self.remaining)
+            }
+
+
+# One budget shared by every Reporter in the process
+scheduler = RequestScheduler()
@@ -0,0 +1,225 @@
+import bisect
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple
+from details import submission_version
+from scheduler import Priority, request_priority
+import utils
+
+# Search over every teacher comment a student has received, across courses and terms.
+# Comments are kept as documents in the cache directory and the inverted index is built
+# from them in memory. Assignments are re-indexed whenever their loaded comments differ
+# from the indexed ones, and never dropped, so earlier terms stay searchable. Background
+# updates fetch comments again for assignments whose assignment or submission changed
+# since their comments were last fetched for the index. Hits are ranked by BM25 over the
+# comment text, author and assignment name, newest first on ties.
+
+STOP_WORDS = {"a", "an", "and", "are", "as", "at", "be", "for", "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "with", "you", "your"}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+def tokens(text):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOP_WORDS]
+
+# Changes when Canvas updates the assignment or the submission, e.g. when a comment is added
+def content_version(assignment):
+    return str((getattr(assignment.assignment, "updated_at", None), submission_version(assignment.submission)))
+
+
+class SearchHit(NamedTuple):
+    score: float
+    course: str
+    assignment_id: int
+    assignment: str
+    author: str
+    date: str
+    text: str
+
+    def posted_date(self):
+        return datetime.fromisoformat(self.date)
+
+
+class CommentIndex:
+    def __init__(self, student):
+        self.logger = logging.getLogger(__name__)
+        self.student = student
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.signatures = {}
+        self.versions = {}
+        self.postings = {}
+        self.lengths = {}
+        self.vocabulary = None
+        self.changed = False
+        self.load()
+
+    def path(self):
+        return utils.cache_path("search", utils.safe_filename(self.student) + ".json")
+
+    def load(self):
+        path = self.path()
+        if not os.path.exists(path):
+            return
+        with open(path) as json_file:
+            data = json.load(json_file)
+        with self.lock:
+            for id, signature in data["signatures"].items():
+                self.signatures[int(id)] = signature
+            for id, version in data.get("versions", {}).items():
+                self.versions[int(id)] = version
+            for doc_id, document in data["documents"].items():
+                self.add_document(doc_id, document)
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            data = json.dumps({"signatures": self.signatures, "versions": self.versions, "documents": self.documents})
+            self.changed = False
+        path = self.path()
+        with open(path + ".tmp", "w") as json_file:
+            json_file.write(data)
+        os.replace(path + ".tmp", path)
+
+    # Called with lock held
+    def add_document(self, doc_id, document):
+        terms = tokens(document["text"]) + tokens(document["author"]) + tokens(document["assignment"])
+        self.documents[doc_id] = document
+        self.lengths[doc_id] = len(terms)
+        for term in terms:
+            postings = self.postings.setdefault(term, {})
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+        self.vocabulary = None
+
+    def remove_document(self, doc_id):
+        document = self.documents.pop(doc_id)
+        del self.lengths[doc_id]
+        for term in set(tokens(document["text"]) + tokens(document["author"]) + tokens(document["assignment"])):
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+        self.vocabulary = None
+
+    # Indexes the assignment's comments if they are loaded and differ from the indexed ones.
+    # version is the content_version the comments were fetched at, if they were fetched for the index.
+    def add_assignment(self, assignment, version=None):
+        if not assignment.have_loaded_submission_comments:
+            return False
+        comments = assignment.submission_comments
+        signature = [len(comments), comments[-1].date.isoformat() if comments else None]
+        with self.lock:
+            if version is not None and self.versions.get(assignment.id) != version:
+                self.versions[assignment.id] = version
+                self.changed = True
+            if self.signatures.get(assignment.id) == signature:
+                return False
+            for doc_id in [d for d in self.documents if d.startswith("{}:".format(assignment.id))]:
+                self.remove_document(doc_id)
+            for i, comment in enumerate(comments):
+                self.add_document("{}:{}".format(assignment.id, i), {
+                    "course": assignment.get_course_name(),
+                    "assignment_id": assignment.id,
+                    "assignment": assignment.get_name(),
+                    "author": comment.author,
+                    "date": comment.date.isoformat(),
+                    "text": comment.text
+                })
+            self.signatures[assignment.id] = signature
+            self.changed = True
+        return True
+
+    # Indexes the reporter's assignments. With fetch, comments of assignments never fetched
+    # for the index, or changed since, are loaded from Canvas first, in batches per course.
+    # Versions are taken before fetching, so changes made meanwhile are fetched next time.
+    def update(self, reporter, fetch=False):
+        start_time = time.time()
+        indexed = 0
+        for course in list(reporter.courses.values()):
+            assignments = list(course.assignments.values()) + list(course.invalid_assignments.values())
+            versions = {}
+            if fetch:
+                versions = {a.id: content_version(a) for a in assignments}
+                with self.lock:
+                    changed = [a for a in assignments if self.versions.get(a.id) != versions[a.id]]
+                if changed:
+                    course.reload_comments_for(changed)
+            for assignment in assignments:
+                if self.add_assignment(assignment, versions.get(assignment.id)):
+                    indexed += 1
+        self.logger.info("Indexed comments of {} assignments for {} in {}s".format(indexed, self.student, time.time() - start_time))
+        return indexed
+
+    # Terms in the index starting with prefix, so partial words still match
+    def expand(self, term):
+        if term in self.postings:
+            return [term]
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        first = bisect.bisect_left(self.vocabulary, term)
+        last = bisect.bisect_left(self.vocabulary, term + "\uffff")
+        return self.vocabulary[first:last]
+
+    def search(self, query, limit=20):
+        with self.lock:
+            count = len(self.documents)
+            if not count:
+                return []
+            average_length = sum(self.lengths.values()) / count
+            scores = {}
+            for term in tokens(query):
+                for match in self.expand(term):
+                    postings = self.postings[match]
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for doc_id, frequency in postings.items():
+                        norm = frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * self.lengths[doc_id] / average_length))
+                        scores[doc_id] = scores.get(doc_id, 0) + idf * norm
+            ranked = sorted(scores.items(), key=lambda item: (item[1], self.documents[item[0]]["date"]), reverse=True)[:limit]
+            hits = []
+            for doc_id, score in ranked:
+                d = self.documents[doc_id]
+                hits.append(SearchHit(round(score, 3), d["course"], d["assignment_id"], d["assignment"], d["author"], d["date"], d["text"]))
+            return hits
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+def index_for(student):
+    with indexes_lock:
+        index = indexes.get(student)
+        if index is None:
+            index = indexes[student] = CommentIndex(student)
+        return index
+
+indexing = set()
+
+# Brings the student's index up to date with the reporter in a background thread, fetching
+# comments not yet indexed, or changed since, at background priority. Does nothing while one is already running.
+def update_in_background(student, reporter):
+    with indexes_lock:
+        if student in indexing:
+            return
+        indexing.add(student)
+
+    def run():
+        try:
+            index = index_for(student)
+            with request_priority(Priority.Background):
+                index.update(reporter, fetch=True)
+            index.save()
+        except Exception as e:
+            logging.getLogger(__name__).warning("Indexing comments for {} failed: {}".format(student, e))
+        finally:
+            with indexes_lock:
+                indexing.discard(student)
+
+    threading.Thread(target=run, name="search-" + student, daemon=True).start()
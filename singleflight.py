@@ -0,0 +1,33 @@
+import threading
+from concurrent.futures import Future
+
+
+# Coalesces concurrent calls that share a key: the first caller runs the function and
+# everyone who arrives while it is in flight waits for, and shares, the same result
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = fn(*args, **kwargs)
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def in_flight(self, key):
+        with self.lock:
+            return key in self.calls
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple
+from assignment import SubmissionStatus
+from course import CourseScore
+import utils
+
+
+class AssignmentRow(NamedTuple):
+    course: str
+    id: int
+    name: str
+    status: str
+    due: str
+    submitted: str
+    graded: str
+    attempts: int
+    score: float
+    possible_gain: int
+
+    def due_date(self):
+        return datetime.fromisoformat(self.due) if self.due else None
+
+
+class AnnouncementRow(NamedTuple):
+    course: str
+    title: str
+    date: str
+
+    def posted_date(self):
+        return datetime.fromisoformat(self.date)
+
+
+def iso(date):
+    return date.isoformat() if date else None
+
+def assignment_row(a):
+    return AssignmentRow(a.course, a.id, a.name, a.status.name, iso(a.due_date), iso(a.submission_date), iso(a.graded_date), a.attempts, a.score, a.possible_gain)
+
+# Sections holding assignment rows, the rest hold CourseScore rows or single values
+assignment_sections = ["today", "week", "missing", "low_score", "being_marked", "has_comment"]
+
+
+# The reports for one student at one point in time. Sections are tuples of rows so they can
+# be compared, hashed and rendered without touching Canvas. Minimum gain filters are left to
+# whoever renders them.
+class Snapshot(NamedTuple):
+    student: str
+    version: int
+    taken_at: float
+    etag: str
+    sections: dict
+
+    @staticmethod
+    def build(student, reporter, date=None):
+        date = date if date else datetime.today()
+        sections = {
+            "scores":       tuple(reporter.get_course_scores()),
+            "today":        tuple(assignment_row(a) for a in reporter.run_daily_submission_report(date)),
+            "week":         tuple(assignment_row(a) for a in reporter.run_calendar_report(date)),
+            "missing":      tuple(assignment_row(a) for a in reporter.run_assignment_report(SubmissionStatus.Missing, 0)),
+            "low_score":    tuple(assignment_row(a) for a in reporter.run_assignment_report(SubmissionStatus.Low_Score, 0)),
+            "being_marked": tuple(assignment_row(a) for a in reporter.run_assignment_report(SubmissionStatus.Being_Marked, 0)),
+            "has_comment":  tuple(assignment_row(a) for a in reporter.run_assignment_report(SubmissionStatus.Has_Comment, 0)),
+            "announcements": tuple(AnnouncementRow(a.course, a.title, iso(a.date)) for a in reporter.get_announcements()),
+            "service":      (reporter.get_remaining_service_hours(),),
+            "stale":        tuple(sorted(c.name for c in reporter.courses.values() if c.stale))
+        }
+        return Snapshot(student, 0, time.time(), section_etag(sections), sections)
+
+    def to_json(self):
+        return json.dumps({"student": self.student, "version": self.version, "taken_at": self.taken_at, "etag": self.etag, "sections": self.sections})
+
+    @staticmethod
+    def from_json(text):
+        data = json.loads(text)
+        sections = {}
+        for name, rows in data["sections"].items():
+            if name in assignment_sections:
+                sections[name] = tuple(AssignmentRow(*row) for row in rows)
+            elif name == "scores":
+                sections[name] = tuple(CourseScore(*row) for row in rows)
+            elif name == "announcements":
+                sections[name] = tuple(AnnouncementRow(*row) for row in rows)
+            else:
+                sections[name] = tuple(rows)
+        return Snapshot(data["student"], data["version"], data["taken_at"], data["etag"], sections)
+
+
+def section_etag(sections):
+    text = json.dumps(sections, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+# Latest snapshot per student, kept in memory and written through to the cache directory so
+# other processes and restarts see it. A new snapshot only takes a new version (and
+# taken_at) when its content differs from the current one.
+class SnapshotStore:
+    def __init__(self, directory="snapshots"):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.snapshots = {}
+        self.mtimes = {}
+
+    def path(self, student):
+        return utils.cache_path(self.directory, utils.safe_filename(student) + ".json")
+
+    def put(self, snapshot):
+        with self.lock:
+            current = self.get_locked(snapshot.student)
+            if current and current.etag == snapshot.etag:
+                return current
+            version = current.version + 1 if current else 1
+            snapshot = snapshot._replace(version=version)
+            path = self.path(snapshot.student)
+            with open(path + ".tmp", "w") as json_file:
+                json_file.write(snapshot.to_json())
+            os.replace(path + ".tmp", path)
+            self.snapshots[snapshot.student] = snapshot
+            self.mtimes[snapshot.student] = os.path.getmtime(path)
+            self.logger.info("Snapshot {} version {}".format(snapshot.student, version))
+            self.changed.notify_all()
+            return snapshot
+
+    def get(self, student):
+        with self.lock:
+            return self.get_locked(student)
+
+    # Records that someone looked at the student's reports, for refresh scheduling
+    def touch(self, student):
+        path = utils.cache_path(self.directory, utils.safe_filename(student) + ".seen")
+        with open(path, "a"):
+            os.utime(path)
+
+    def last_seen(self, student):
+        path = utils.cache_path(self.directory, utils.safe_filename(student) + ".seen")
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    # Blocks until the student's snapshot is no longer at version, or returns None after
+    # timeout. Wakes every few seconds to pick up snapshots written by other processes.
+    def wait(self, student, version, timeout):
+        deadline = time.time() + timeout
+        with self.changed:
+            while True:
+                snapshot = self.get_locked(student)
+                if snapshot and snapshot.version != version:
+                    return snapshot
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.changed.wait(min(remaining, 5))
+
+    # Picks up snapshots written by other processes
+    def get_locked(self, student):
+        path = self.path(student)
+        if os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            if mtime != self.mtimes.get(student):
+                with open(path) as json_file:
+                    self.snapshots[student] = Snapshot.from_json(json_file.read())
+                self.mtimes[student] = mtime
+        return self.snapshots.get(student)
+
+
+snapshots = SnapshotStore()
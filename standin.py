@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import re
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import urllib.request
+from datetime import datetime, timezone
+
+# Local stand-ins for the Canvas services this app talks to, for trying features without
+# a Canvas instance.
+#
+#   python standin.py events --event grade_change --user 5573 --assignment 159434 --score 9 --secret S
+#                                              (app: CCANVAS_EVENT_SECRET=S, or CCANVAS_EVENTS_INSECURE=1 without --secret)
+#   python standin.py files --directory ~/slides --port 8001
+#   python standin.py graphql --port 8002      (config.json: "url": "http://localhost:8002", "loader": "graphql")
+#
+# catalog.json grades the sample fixture's courses at http://localhost:8002; a fixture with
+# other courses, or another port, needs an entry of its own.
+
+
+def now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+# Live Events shaped payload for the event named on the command line
+def live_event(args):
+    body = {"user_id": str(args.user), "assignment_id": str(args.assignment)}
+    if args.event in ["submission_created", "submission_updated"]:
+        body.update({"submitted_at": now(), "attempt": args.attempt, "workflow_state": "submitted", "late": False, "missing": False})
+    elif args.event == "grade_change":
+        body.update({"student_id": str(args.user), "score": args.score, "grading_complete": True})
+    elif args.event == "submission_comment_created":
+        body = {"user_id": str(args.author), "submission_id": str(args.submission), "created_at": now(), "body": args.text}
+    elif args.event == "assignment_updated":
+        body = {"assignment_id": str(args.assignment), "title": args.text, "due_at": args.due, "points_possible": args.points}
+        body = {k: v for k, v in body.items() if v is not None}
+    return {"metadata": {"event_name": args.event, "event_time": now()}, "body": body}
+
+def send_events(args):
+    payload = json.dumps(live_event(args)).encode()
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Event-Secret"] = args.secret
+    request = urllib.request.Request(args.url, data=payload, headers=headers, method="POST")
+    with urllib.request.urlopen(request) as response:
+        print(response.read().decode())
+
+# Serves a directory the way Canvas serves file downloads, including Range requests.
+# --throttle cuts each response short after that many bytes to exercise resumed downloads.
+class FileHandler(BaseHTTPRequestHandler):
+    directory = "."
+    throttle = None
+
+    def do_GET(self):
+        path = os.path.join(self.directory, os.path.basename(self.path.split("?")[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(size))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        with open(path, "rb") as file:
+            file.seek(start)
+            data = file.read(self.throttle) if self.throttle else file.read()
+        self.wfile.write(data)
+
+def serve_files(args):
+    FileHandler.directory = os.path.expanduser(args.directory)
+    FileHandler.throttle = args.throttle
+    server = ThreadingHTTPServer(("localhost", args.port), FileHandler)
+    print("Serving {} on http://localhost:{}/".format(FileHandler.directory, args.port))
+    server.serve_forever()
+
+# A student with two courses in GraphQL node form, used when no --fixture is given
+def sample_fixture():
+    def assignment(id, name, due, group, points=10):
+        return {"_id": str(id), "name": name, "dueAt": due, "lockAt": None, "pointsPossible": points, "submissionTypes": ["online_upload"],
+                "updatedAt": "2026-09-01T08:00:00-07:00", "assignmentGroupId": str(group)}
+    def submission(id, assignment, score, submitted, comments=()):
+        return {"_id": str(id), "assignmentId": str(assignment), "score": score, "attempt": 1 if submitted else 0, "submittedAt": submitted,
+                "gradedAt": "2026-09-10T20:00:00Z" if score is not None else None, "state": "graded" if score is not None else "unsubmitted",
+                "excused": False, "late": False, "missing": False,
+                "commentsConnection": {"nodes": [{"author": {"name": "Ms Teacher"}, "comment": c, "createdAt": "2026-09-10T20:00:00Z"} for c in comments]}}
+    term = {"name": "Fall 2026", "end_at": "2027-01-15T08:00:00Z"}
+    return {
+        "user": {"id": 5573, "name": "Sam Student"},
+        "courses": [
+            {"id": 101, "name": "MATH 1210 Calculus", "term": term, "hide_final_grades": True, "enrollments": [{"computed_current_score": None}],
+             "assignmentGroups": [{"_id": "11", "name": "Homework", "groupWeight": 40}, {"_id": "12", "name": "Exams", "groupWeight": 60}],
+             "assignments": [assignment(1001, "Limits", "2026-09-08T06:59:59Z", 11), assignment(1002, "Derivatives", "2026-09-15T06:59:59Z", 11),
+                             assignment(1003, "Midterm", "2026-10-20T06:59:59Z", 12, 100)],
+             "submissions": [submission(9001, 1001, 9, "2026-09-07T20:00:00Z"), submission(9002, 1002, 6, "2026-09-14T20:00:00Z", ["Show your work"])]},
+            {"id": 102, "name": "CHEM 1210 Chemistry", "term": term, "hide_final_grades": False, "enrollments": [{"computed_current_score": 88.4}],
+             "assignmentGroups": [{"_id": "21", "name": "Labs", "groupWeight": 0}],
+             "assignments": [assignment(2001, "Lab 1", "2026-09-09T06:59:59Z", 21), assignment(2002, "Lab 2", "2026-10-21T06:59:59Z", 21)],
+             "submissions": [submission(9101, 2001, 8, "2026-09-08T20:00:00Z")]}
+        ]
+    }
+
+# One page of a connection, cursors are node offsets
+def page(nodes, first, after):
+    start = int(after) if after else 0
+    end = start + first
+    return {"pageInfo": {"hasNextPage": end < len(nodes), "endCursor": str(end)}, "nodes": nodes[start:end]}
+
+# A fixture submission node as the REST submissions endpoint returns it, with the comments
+# that the GraphQL load leaves out
+def rest_submission(node, user_id, include):
+    submission = {"id": int(node["_id"]), "assignment_id": int(node["assignmentId"]), "user_id": user_id, "score": node["score"],
+                  "attempt": node["attempt"], "submitted_at": node["submittedAt"], "graded_at": node["gradedAt"],
+                  "workflow_state": node["state"], "excused": node["excused"], "late": node["late"], "missing": node["missing"]}
+    if "submission_comments" in include:
+        submission["submission_comments"] = [{"author_name": c["author"]["name"], "comment": c["comment"], "created_at": c["createdAt"]}
+                                             for c in node.get("commentsConnection", {}).get("nodes", [])]
+    if "submission_history" in include:
+        submission["submission_history"] = [dict(submission)]
+    return submission
+
+# Answers the course queries graphql_loader.py sends, and the REST calls a Reporter makes
+# around them (user, courses, announcements, submission comments), from a fixture file
+class CanvasHandler(BaseHTTPRequestHandler):
+    fixture = None
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/api/v1/users/self":
+            self.send_json(self.fixture["user"])
+        elif path == "/api/v1/courses":
+            fields = ["id", "name", "term", "hide_final_grades", "enrollments"]
+            self.send_json([{k: c[k] for k in fields} for c in self.fixture["courses"]])
+        elif path == "/api/v1/announcements":
+            self.send_json(self.fixture.get("announcements", []))
+        elif re.fullmatch(r"/api/v1/courses/\d+/students/submissions", path):
+            course = next((c for c in self.fixture["courses"] if str(c["id"]) == path.split("/")[4]), None)
+            if course is None:
+                self.send_error(404)
+                return
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            ids = set(params.get("assignment_ids[]", []))
+            include = params.get("include[]", [])
+            user_id = self.fixture["user"]["id"]
+            self.send_json([rest_submission(s, user_id, include) for s in course["submissions"] if not ids or s["assignmentId"] in ids])
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/api/graphql":
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            query = json.loads(body)["query"]
+        else:
+            query = urllib.parse.parse_qs(body)["query"][0]
+        courses = {str(c["id"]): c for c in self.fixture["courses"]}
+        data = {}
+        blocks = re.split(r"(?=\b\w+: course\()", query)
+        for block in blocks:
+            match = re.match(r'(\w+): course\(id: "(\d+)"\)', block)
+            if not match:
+                continue
+            course = courses.get(match.group(2))
+            if course is None:
+                data[match.group(1)] = None
+                continue
+            result = {"_id": str(course["id"])}
+            for connection, key in [("assignmentsConnection", "assignments"), ("submissionsConnection", "submissions")]:
+                args = re.search(connection + r'\(first: (\d+)(?:, after: "(\d+)")?', block)
+                if args:
+                    result[connection] = page(course[key], int(args.group(1)), args.group(2))
+            if "assignmentGroupsConnection" in block:
+                result["assignmentGroupsConnection"] = {"nodes": course["assignmentGroups"]}
+            data[match.group(1)] = result
+        self.send_json({"data": data})
+
+def serve_canvas(args):
+    if args.fixture:
+        with open(args.fixture) as json_file:
+            CanvasHandler.fixture = json.load(json_file)
+    else:
+        CanvasHandler.fixture = sample_fixture()
+    server = ThreadingHTTPServer(("localhost", args.port), CanvasHandler)
+    print("Canvas GraphQL stand-in on http://localhost:{}/".format(args.port))
+    server.serve_forever()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local Canvas stand-ins')
+    commands = parser.add_subparsers(dest="command", required=True)
+    events = commands.add_parser("events", help="post a Canvas Live Event to /events")
+    events.add_argument('--url', default="http://localhost:5000/events", help='event endpoint')
+    events.add_argument('--secret', default=None, help='X-Event-Secret header')
+    events.add_argument('--event', required=True, choices=["submission_created", "submission_updated", "grade_change", "submission_comment_created", "assignment_updated"])
+    events.add_argument('--user', type=int, default=0, help='student id')
+    events.add_argument('--assignment', type=int, default=0, help='assignment id')
+    events.add_argument('--submission', type=int, default=0, help='submission id (comments)')
+    events.add_argument('--author', type=int, default=0, help='comment author id')
+    events.add_argument('--score', type=float, default=None)
+    events.add_argument('--attempt', type=int, default=1)
+    events.add_argument('--points', type=float, default=None, help='points possible')
+    events.add_argument('--due', default=None, help='due date, ISO 8601')
+    events.add_argument('--text', default=None, help='comment text or assignment title')
+    events.set_defaults(run=send_events)
+    files = commands.add_parser("files", help="serve course files with Range support")
+    files.add_argument('--directory', default=".", help='directory holding the files')
+    files.add_argument('--port', type=int, default=8001)
+    files.add_argument('--throttle', type=int, default=None, help='bytes sent per response')
+    files.set_defaults(run=serve_files)
+    graphql = commands.add_parser("graphql", help="serve courses, assignments and submissions over GraphQL")
+    graphql.add_argument('--fixture', default=None, help='JSON fixture, see sample_fixture()')
+    graphql.add_argument('--port', type=int, default=8002)
+    graphql.set_defaults(run=serve_canvas)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.run(args)
@@ -0,0 +1,119 @@
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import NamedTuple
+import pytz
+from catalog import catalogs
+from course import Course
+from reporter import Reporter
+
+# Synthetic students shaped like the canvasapi objects the loaders produce, for timing the
+# reports without a Canvas instance (see benchmark.py). The same seed gives the same data.
+
+# Course codes of the synthetic courses, graded by a catalog of their own
+COURSE_CODES = ["CINE 260M", "CS 111", "EC 201", "MATH 111", "J 100", "J 350", "MUS 151", "MUS 227",
+                "PPPM 101", "GEOG 208", "LING 201", "ANTH 110", "ARTD 251", "CRWR 230", "HUM 102", "PEL 399"]
+CATALOG = catalogs.build({"courses": COURSE_CODES})
+
+GROUPS = [("Homework", 30), ("Quizzes", 20), ("Labs", 15), ("Exams", 35), ("Attendance", 0)]
+
+class SyntheticCourse(NamedTuple):
+    raw: SimpleNamespace
+    groups: list
+    assignments: list
+    submissions: dict
+
+class SyntheticStudent(NamedTuple):
+    user: SimpleNamespace
+    courses: list
+
+
+def canvas_time(date):
+    return date.astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def synthetic_course(rng, id, name, now):
+    term = {"name": "Fall {}".format(now.year), "end_at": canvas_time(now + timedelta(days=60))}
+    score = round(rng.uniform(60, 100), 1)
+    return SimpleNamespace(id=id, name=name, term=term, hide_final_grades=rng.random() < 0.3, enrollments=[{"computed_current_score": score}])
+
+def synthetic_groups(course_id):
+    return [SimpleNamespace(id=course_id * 100 + i, name=name, group_weight=weight) for i, (name, weight) in enumerate(GROUPS)]
+
+def synthetic_submission(rng, assignment, due, now):
+    submission = SimpleNamespace(id=assignment.id + 1000000000, assignment_id=assignment.id, score=None, attempt=0,
+                                 submitted_at=None, graded_at=None, workflow_state="unsubmitted",
+                                 excused=False, late=False, missing=False, submission_comments=[])
+    roll = rng.random()
+    if due < now:
+        if roll < 0.65:
+            submitted = due - timedelta(hours=rng.randint(1, 48))
+            submission.submitted_at = canvas_time(submitted)
+            submission.attempt = 1
+            submission.score = round(assignment.points_possible * rng.triangular(0.4, 1.0, 0.95), 1)
+            submission.graded_at = canvas_time(min(now, submitted + timedelta(days=rng.randint(1, 7))))
+            submission.workflow_state = "graded"
+        elif roll < 0.78:
+            submission.submitted_at = canvas_time(due - timedelta(hours=1))
+            submission.attempt = 1
+            submission.workflow_state = "submitted"
+        elif roll < 0.9:
+            submission.missing = True
+        elif roll < 0.95:
+            submission.excused = True
+    if rng.random() < 0.2:
+        comment_date = min(now, due + timedelta(days=2))
+        submission.submission_comments = [{"author_name": "Ms Teacher", "comment": "Please see the rubric notes", "created_at": canvas_time(comment_date)}]
+    return submission
+
+def synthetic_assignments(rng, course_id, groups, count, now):
+    assignments = []
+    submissions = {}
+    # The last group (Attendance) is filtered out of the weightings like the real one
+    for i in range(count):
+        group = groups[i % len(groups)]
+        due = now + timedelta(days=rng.uniform(-120, 30))
+        a = SimpleNamespace(
+            id=course_id * 1000000 + i,
+            course_id=course_id,
+            name="{} {}".format(group.name, i),
+            due_at=canvas_time(due) if rng.random() > 0.02 else None,
+            lock_at=None,
+            points_possible=rng.choice([5, 10, 10, 20, 50, 100]) if rng.random() > 0.02 else 0,
+            submission_types=["online_upload"] if rng.random() > 0.1 else ["on_paper"],
+            updated_at=canvas_time(due - timedelta(days=14)),
+            assignment_group_id=group.id)
+        assignments.append(a)
+        submissions[a.id] = synthetic_submission(rng, a, due, now)
+    assignments.sort(key=lambda a: a.due_at or "")
+    return assignments, submissions
+
+# count assignments spread evenly over a student's courses
+def synthetic_student(count, courses=8, seed=1, now=None):
+    rng = random.Random(seed)
+    now = now if now else datetime.now(pytz.UTC)
+    user = SimpleNamespace(id=5573, name="Sam Student")
+    result = []
+    names = COURSE_CODES[:courses]
+    for i, name in enumerate(names):
+        course_id = 1000 + i
+        groups = synthetic_groups(course_id)
+        per_course = count // len(names) + (1 if i < count % len(names) else 0)
+        assignments, submissions = synthetic_assignments(rng, course_id, groups, per_course, now)
+        result.append(SyntheticCourse(synthetic_course(rng, course_id, name, now), groups, assignments, submissions))
+    return SyntheticStudent(user, result)
+
+# Courses with their assignments ingested, keyed by course id like Reporter.courses
+def ingest(student):
+    courses = {}
+    for c in student.courses:
+        course = Course(c.raw, catalog=CATALOG)
+        course.commit(course.ingest(student.user, c.assignments, c.submissions))
+        courses[course.id] = course
+    return courses
+
+def synthetic_reporter(student):
+    courses = ingest(student)
+    reporter = Reporter.offline(student.user, courses)
+    for c in student.courses:
+        reporter.calculator.set_groups(courses[c.raw.id], courses[c.raw.id].filter_groups(c.groups))
+    return reporter
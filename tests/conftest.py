@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository, and read catalog.json from the working
+# directory unless told otherwise
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CCANVAS_CATALOG", os.path.join(ROOT, "catalog.json"))
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    import utils
+    monkeypatch.setattr(utils, "CACHE_DIR", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytz
+from duedates import DueDateIndex
+
+PACIFIC = pytz.timezone("US/Pacific")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=pytz.UTC)
+
+def index(*due_dates, timezone=PACIFIC):
+    assignments = {id: SimpleNamespace(id=id, due_date=due, is_valid=due is not None) for id, due in enumerate(due_dates)}
+    return DueDateIndex(assignments, timezone), assignments
+
+def ids(assignments):
+    return [a.id for a in assignments]
+
+
+def test_between_excludes_both_ends():
+    start, end = utc(2026, 3, 2, 12), utc(2026, 3, 9, 12)
+    due_index, _ = index(start, start + timedelta(seconds=1), end - timedelta(seconds=1), end, utc(2026, 3, 1))
+    assert ids(due_index.between(start, end)) == [1, 2]
+
+def test_between_is_in_due_order():
+    due_index, _ = index(utc(2026, 3, 5), utc(2026, 3, 3), utc(2026, 3, 4))
+    assert ids(due_index.between(utc(2026, 3, 1), utc(2026, 3, 10))) == [1, 2, 0]
+
+def test_on_day_uses_the_local_day():
+    # 23:59 and 00:00 Pacific either side of midnight, both on the next day in UTC
+    late, next_day = utc(2026, 3, 3, 7, 59), utc(2026, 3, 3, 8, 0)
+    due_index, _ = index(late, next_day, utc(2026, 3, 2, 8, 0))
+    assert ids(due_index.on_day(utc(2026, 3, 2, 20))) == [2, 0]
+    assert ids(due_index.on_day(utc(2026, 3, 3, 20))) == [1]
+    assert due_index.on_day(utc(2026, 3, 5, 20)) == []
+
+def test_on_day_follows_the_timezone():
+    due = utc(2026, 3, 3, 3)
+    assert ids(index(due)[0].on_day(utc(2026, 3, 2, 20))) == [0]
+    assert ids(index(due, timezone=pytz.UTC)[0].on_day(utc(2026, 3, 3, 20))) == [0]
+
+def test_invalid_and_undated_are_left_out():
+    due_index, assignments = index(utc(2026, 3, 3), None)
+    assert ids(due_index.between(utc(2026, 3, 1), utc(2026, 3, 10))) == [0]
+    assignments[0].is_valid = False
+    assert DueDateIndex(assignments, PACIFIC).between(utc(2026, 3, 1), utc(2026, 3, 10)) == []
+
+def test_is_current():
+    due_index, assignments = index(utc(2026, 3, 3))
+    assert due_index.is_current(assignments, PACIFIC)
+    assert not due_index.is_current(dict(assignments), PACIFIC)
+    assert not due_index.is_current(assignments, pytz.UTC)
@@ -0,0 +1,39 @@
+from datetime import datetime
+import pytz
+from events import apply_events, parse_event
+import synthetic
+
+NOW = datetime(2026, 3, 1, 12, tzinfo=pytz.UTC)
+
+
+def graded_assignment(reporter):
+    for assignment in reporter.assignments.values():
+        if assignment.is_graded() and assignment.assignment.points_possible:
+            return assignment
+    raise AssertionError("no graded assignment")
+
+def grade_change(assignment_id, score):
+    return {"metadata": {"event_name": "grade_change", "event_time": "2026-03-01T13:00:00Z"},
+            "body": {"assignment_id": str(assignment_id), "score": score}}
+
+
+def test_grade_change_updates_score():
+    reporter = synthetic.synthetic_reporter(synthetic.synthetic_student(40, courses=2, now=NOW))
+    assignment = graded_assignment(reporter)
+    points = assignment.assignment.points_possible
+    assert reporter.apply_event(parse_event(grade_change(assignment.id, points / 2)))
+    assert reporter.assignments[assignment.id].get_score() == 50
+    assert reporter.events_applied == 1
+
+def test_unknown_assignment_is_left_for_reload():
+    reporter = synthetic.synthetic_reporter(synthetic.synthetic_student(40, courses=2, now=NOW))
+    assert not reporter.apply_event(parse_event(grade_change(999, 1)))
+    assert reporter.events_applied == 0
+
+def test_apply_events_reports_changed_students():
+    reporter = synthetic.synthetic_reporter(synthetic.synthetic_student(40, courses=2, now=NOW))
+    assignment = graded_assignment(reporter)
+    applied, changed = apply_events({"sam": reporter}, [grade_change(assignment.id, 0), {"metadata": {"event_name": "user_login"}}])
+    assert applied == 1
+    assert changed == {"sam"}
+    assert reporter.assignments[assignment.id].get_score() == 0
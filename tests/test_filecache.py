@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+import filecache
+from filecache import FileCache
+from standin import FileHandler
+
+
+@pytest.fixture
+def served(tmp_path):
+    directory = tmp_path / "served"
+    directory.mkdir()
+
+    class Handler(FileHandler):
+        def log_message(self, *args):
+            pass
+
+    Handler.directory = str(directory)
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield SimpleNamespace(directory=directory, handler=Handler, url="http://localhost:{}/".format(server.server_port))
+    server.shutdown()
+    server.server_close()
+
+def course_file(served, id, data, size=True):
+    name = "file{}.bin".format(id)
+    (served.directory / name).write_bytes(data)
+    file = SimpleNamespace(id=id, filename=name, url=served.url + name, updated_at="2026-03-01T12:00:00Z")
+    if size:
+        file.size = len(data)
+    return file
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_download_resumes_after_short_responses(cache_dir, served):
+    data = os.urandom(10000)
+    file = course_file(served, 1, data)
+    served.handler.throttle = 3000
+    cache = FileCache()
+    attempts = 0
+    path = None
+    while path is None:
+        attempts += 1
+        assert attempts <= 4
+        try:
+            path = cache.get(file)
+        except Exception:
+            assert os.path.getsize(cache.path(file) + ".part") == 3000 * attempts
+    assert attempts == 4
+    assert open(path, "rb").read() == data
+    assert cache.get(file) == path
+    assert cache.stats()["hits"] == 1
+
+def test_size_from_response_when_not_listed(cache_dir, served):
+    data = os.urandom(5000)
+    path = FileCache().get(course_file(served, 2, data, size=False))
+    assert open(path, "rb").read() == data
+
+def test_removed_entry_is_downloaded_again(cache_dir, served):
+    cache = FileCache()
+    file = course_file(served, 3, b"x" * 100)
+    path = cache.get(file)
+    os.remove(path)
+    assert cache.get(file) == path
+    assert cache.stats()["misses"] == 2
+
+def test_least_recently_used_evicted(cache_dir, served):
+    cache = FileCache(max_bytes=2500)
+    files = [course_file(served, id, os.urandom(1000)) for id in (10, 11, 12)]
+    paths = [cache.get(file) for file in files[:2]]
+    age(paths[0], 60)
+    age(paths[1], 120)
+    cache.get(files[2])
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
+    assert cache.stats()["evictions"] == 1
+
+def test_part_files_count_and_expire(cache_dir, served):
+    cache = FileCache(max_bytes=2500)
+    fresh = os.path.join(cache.root, "20-0.bin.part")
+    orphan = os.path.join(cache.root, "21-0.bin.part")
+    for part in (fresh, orphan):
+        with open(part, "wb") as out:
+            out.write(b"x" * 1000)
+    age(orphan, filecache.PART_EXPIRY + 60)
+    old = cache.get(course_file(served, 22, os.urandom(1000)))
+    age(old, 60)
+    new = cache.get(course_file(served, 23, os.urandom(1000)))
+    assert not os.path.exists(orphan)
+    assert os.path.exists(fresh)
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert cache.stats()["expired_parts"] == 1
@@ -0,0 +1,52 @@
+from datetime import datetime
+import pytz
+import synthetic
+from search import CommentIndex
+
+NOW = datetime(2026, 3, 1, 12, tzinfo=pytz.UTC)
+
+
+# Serves comments from a dict instead of Canvas, counting the assignments fetched
+def fake_comments(reporter, comments):
+    fetched = []
+    for course in reporter.courses.values():
+        def get_comments(batch):
+            fetched.extend(a.id for a in batch)
+            return {a.id: comments.get(a.id, []) for a in batch}
+        course.get_comments = get_comments
+    return fetched
+
+def comment(text, date):
+    return {"author_name": "Ms Teacher", "comment": text, "created_at": date}
+
+
+def test_changed_submissions_are_fetched_again(cache_dir):
+    reporter = synthetic.synthetic_reporter(synthetic.synthetic_student(20, courses=1, now=NOW))
+    assignment = next(iter(reporter.assignments.values()))
+    comments = {assignment.id: [comment("Good start on the outline", "2026-02-01T18:00:00Z")]}
+    fetched = fake_comments(reporter, comments)
+    index = CommentIndex("sam")
+
+    index.update(reporter, fetch=True)
+    assert assignment.id in fetched
+    assert [hit.assignment_id for hit in index.search("outline")] == [assignment.id]
+
+    fetched.clear()
+    index.update(reporter, fetch=True)
+    assert fetched == []
+
+    comments[assignment.id].append(comment("Bibliography is missing", "2026-02-03T18:00:00Z"))
+    assignment.update_submission({"updated_at": "2026-02-03T18:00:00Z"})
+    index.update(reporter, fetch=True)
+    assert fetched == [assignment.id]
+    assert [hit.assignment_id for hit in index.search("bibliography")] == [assignment.id]
+
+def test_versions_are_saved(cache_dir):
+    reporter = synthetic.synthetic_reporter(synthetic.synthetic_student(20, courses=1, now=NOW))
+    fake_comments(reporter, {})
+    index = CommentIndex("sam")
+    index.update(reporter, fetch=True)
+    index.save()
+    fetched = fake_comments(reporter, {})
+    CommentIndex("sam").update(reporter, fetch=True)
+    assert fetched == []
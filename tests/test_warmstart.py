@@ -0,0 +1,55 @@
+from datetime import datetime
+import pytz
+import synthetic
+import utils
+import warmstart
+
+NOW = datetime(2026, 3, 1, 12, tzinfo=pytz.UTC)
+CONFIG = {"url": "https://canvas.uoregon.edu", "key": "test", "timezone": "America/Denver"}
+
+
+def saved_reporter(cache_dir):
+    reporter = synthetic.synthetic_reporter(synthetic.synthetic_student(120, courses=4, now=NOW))
+    reporter.config = CONFIG
+    warmstart.save("sam", reporter)
+    return reporter
+
+
+def test_round_trip(cache_dir):
+    reporter = saved_reporter(cache_dir)
+    restored = warmstart.load("sam", CONFIG)
+    assert restored is not None
+    assert restored.loaded_at == reporter.saved_at
+    assert sorted(restored.courses) == sorted(reporter.courses)
+    assert sorted(restored.assignments) == sorted(reporter.assignments)
+    for id, assignment in reporter.assignments.items():
+        copy = restored.assignments[id]
+        assert copy.get_due_date() == assignment.get_due_date()
+        assert copy.get_score() == assignment.get_score()
+        assert copy.status == assignment.status
+        assert copy.possible_gain == assignment.possible_gain
+        assert [(c.author, c.date, c.text) for c in copy.submission_comments] == \
+               [(c.author, c.date, c.text) for c in assignment.submission_comments]
+    assert restored.calculator.weighting_totals == reporter.calculator.weighting_totals
+
+def test_timezone_comes_from_config(cache_dir):
+    saved_reporter(cache_dir)
+    restored = warmstart.load("sam", {**CONFIG, "timezone": "US/Eastern"})
+    assert restored.timezone.zone == "US/Eastern"
+    restored = warmstart.load("sam", {key: value for key, value in CONFIG.items() if key != "timezone"})
+    assert restored.timezone.zone == warmstart.DEFAULT_TIMEZONE
+
+def test_restore_parses_no_dates(cache_dir, monkeypatch):
+    saved_reporter(cache_dir)
+
+    def convert_date(canvas_date):
+        raise AssertionError("parsed {}".format(canvas_date))
+
+    monkeypatch.setattr(utils, "convert_date", convert_date)
+    assert warmstart.load("sam", CONFIG) is not None
+
+def test_other_instance_or_term_is_ignored(cache_dir):
+    saved_reporter(cache_dir)
+    assert warmstart.load("sam", {**CONFIG, "url": "https://utah.instructure.com"}) is None
+    assert warmstart.load("sam", CONFIG, "Spring_2026") is None
+    assert warmstart.load("alex", CONFIG) is None
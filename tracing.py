@@ -0,0 +1,108 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+# Structured traces, recorded only for the requests or students they are switched on for.
+# A trace belongs to the context that began it and follows it into executor tasks started
+# with scheduler.submit. With no trace active, event() and span() return after one lookup;
+# hot loops should fetch active() once and skip building fields when it is None.
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+trace_ids = itertools.count(1)
+
+
+class Trace:
+    def __init__(self, name, fields):
+        self.id = next(trace_ids)
+        self.name = name
+        self.fields = fields
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.records = []
+
+    def elapsed_ms(self):
+        return round(1000 * (time.perf_counter() - self.start), 3)
+
+    def event(self, name, /, **fields):
+        self.records.append({"t": self.elapsed_ms(), "event": name, "thread": threading.current_thread().name, **fields})
+
+    @contextlib.contextmanager
+    def span(self, name, /, **fields):
+        record = {"t": self.elapsed_ms(), "span": name, "thread": threading.current_thread().name, **fields}
+        self.records.append(record)
+        try:
+            yield record
+        finally:
+            record["ms"] = round(self.elapsed_ms() - record["t"], 3)
+
+    def summary(self):
+        return {**self.fields, "id": self.id, "trace": self.name, "started": self.started, "ms": self.duration, "records": len(self.records)}
+
+    def to_dict(self):
+        return {**self.summary(), "records": self.records}
+
+
+# The last size finished traces
+class TraceBuffer:
+    def __init__(self, size=50):
+        self.lock = threading.Lock()
+        self.traces = deque(maxlen=size)
+
+    def add(self, trace):
+        with self.lock:
+            self.traces.append(trace)
+
+    def get(self, id):
+        with self.lock:
+            for trace in self.traces:
+                if trace.id == id:
+                    return trace
+        return None
+
+    def summaries(self):
+        with self.lock:
+            return [trace.summary() for trace in reversed(self.traces)]
+
+    def stats(self):
+        with self.lock:
+            return {"traces": len(self.traces), "size": self.traces.maxlen}
+
+
+traces = TraceBuffer()
+
+def active():
+    return current_trace.get()
+
+def event(name, /, **fields):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.event(name, **fields)
+
+def span(name, /, **fields):
+    trace = current_trace.get()
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.span(name, **fields)
+
+# Records a trace of the enclosed work when enabled, kept in traces once it ends
+@contextlib.contextmanager
+def tracing(name, enabled=True, /, **fields):
+    if not enabled:
+        yield None
+        return
+    trace = Trace(name, fields)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        trace.duration = trace.elapsed_ms()
+        traces.add(trace)
+
+def to_json(trace):
+    return json.dumps(trace.to_dict(), default=str, indent=1)
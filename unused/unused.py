@@ -1,14 +1,8 @@
-import wget
-import tempfile
+import urllib.error
 import pptx
+from filecache import FileCache
 
-def is_useful_announcement(self, title):
-    if title.startswith("****"):
-        return False
-    elif title.startswith("Attendance"):
-        return False
-    return True
-
+file_cache = FileCache()
 
 def get_check_in_time(self, date):
     courses = [5237, 4843, 5237, 4843, 5237]
@@ -31,32 +25,11 @@ def get_check_in_time(self, date):
             pass
     return None
 
-def get_announcements(self):
-    courses=[]
-    for id in self.course_dict:
-        courses.append("course_" + str(id))
-    today = datetime.today().astimezone(pytz.timezone('US/Pacific'))
-    start_date = today - timedelta(hours=12)
-    start_date = start_date.strftime("%Y-%m-%d")
-    announcements=[]
-    for a in self.canvas.get_announcements(context_codes=courses, start_date=start_date):
-        if self.is_useful_announcement(a.title):
-            course = self.course_short_name(self.course_dict[int(a.context_code[7:])])
-            announcements.append(Announcement(course, a.title, a.message, a.posted_at))
-    return announcements
-
-
-
 def download_file(self, file):
-    path = os.path.join(tempfile.gettempdir(), file.filename)
-    print(path)
-    print(file.url)
-    if not os.path.exists(path):
-        try:
-            wget.download(file.url, out=path)
-        except:
-            return None
-    return path
+    try:
+        return file_cache.get(file)
+    except (OSError, urllib.error.URLError):
+        return None
 
 def get_course(self, name):
     for course in self.courses:
@@ -78,6 +51,8 @@ def get_english_notes(self):
                 break
     else:
         return None
+    # The rest of the week's slides are likely wanted next
+    file_cache.prefetch([f for f in files if f.filename <= expected_filename and f.created_at_date > date - timedelta(days=7)])
     filename = file.filename
     print(filename)
     download_path = filename
@@ -1,10 +1,34 @@
+import os
 import pytz
 from datetime import datetime, timedelta
 
+# Local cache for data that outlives a process, e.g. the grades of finished terms
+CACHE_DIR = os.environ.get("CCANVAS_CACHE", ".cache")
+
 def convert_date(canvas_date):
     date = datetime.strptime(canvas_date, '%Y-%m-%dT%H:%M:%SZ')
     if date.hour < 8:
         date = date - timedelta(hours=8)
     return date.replace(tzinfo=pytz.UTC)
 
+# Canvas REST dates are whole seconds in UTC, other sources (Live Events, GraphQL) may add
+# fractions or an offset. Returns the REST form that convert_date() expects.
+def canvas_date(date):
+    if date is None:
+        return None
+    parsed = datetime.fromisoformat(date.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.UTC)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+# Live Events may send global (shard prefixed) IDs as strings
+def local_id(id):
+    return int(id) % 10000000000000
+
+def cache_path(*parts):
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
+def safe_filename(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
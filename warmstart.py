@@ -0,0 +1,203 @@
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from canvasapi import Canvas
+from canvasapi.assignment import Assignment as CanvasAssignment
+from canvasapi.course import Course as CanvasCourse
+from canvasapi.submission import Submission as CanvasSubmission
+from canvasapi.user import User as CanvasUser
+from assignment import Assignment, Comment, SubmissionStatus
+from catalog import catalogs
+from course import Course, CourseAssignments
+from reporter import DEFAULT_TIMEZONE, Reporter
+from scheduler import Priority, request_priority
+from weighting import AssignmentWeighting
+import utils
+
+# Fully ingested reporter state saved in a compact binary file so a new process can report
+# straight away and reconcile with Canvas in the background. The file is a fixed header
+# followed by a pickle of plain dicts and lists (object attributes, not objects), read
+# through a memory map without copying. Dates are pickled as the datetimes they were parsed
+# into, and objects are restored by setting their attributes, so nothing is parsed again.
+# Files with another FORMAT_VERSION are ignored.
+
+MAGIC = b"CCWS"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sI")
+
+logger = logging.getLogger(__name__)
+
+
+def path(student):
+    return utils.cache_path("warm", utils.safe_filename(student) + ".bin")
+
+# canvasapi attributes, including the *_date fields it derived, without the requester
+def attributes(obj):
+    return {k: v for k, v in vars(obj).items() if not k.startswith("_") and k != "submission"}
+
+# An object of cls with the saved attributes, skipping its constructor
+def restore_object(cls, values):
+    obj = cls.__new__(cls)
+    obj.__dict__.update(values)
+    return obj
+
+def restore_canvas_object(cls, requester, values):
+    obj = restore_object(cls, values)
+    obj._requester = requester
+    return obj
+
+# Assignment state derived from the raw objects, restored as is instead of computed again
+ASSIGNMENT_LINKS = ["logger", "user", "assignment", "submission", "comment_loader", "_submission_comments", "status"]
+
+def dump_assignment(a):
+    return {
+        "raw":        attributes(a.assignment),
+        "submission": attributes(a.submission),
+        "state":      {k: v for k, v in vars(a).items() if k not in ASSIGNMENT_LINKS},
+        "comments":   [vars(c) for c in a._submission_comments],
+        "status":     a.status.name
+    }
+
+def dump_course(course):
+    return {
+        "raw":         attributes(course.raw),
+        "loaded_at":   course.loaded_at,
+        "stale":       course.stale,
+        "assignments": [dump_assignment(a) for a in list(course.assignments.values()) + list(course.invalid_assignments.values())],
+        "candidates":  list(course.comment_candidates)
+    }
+
+def dump(reporter):
+    calculator = reporter.calculator
+    return {
+        "url":        reporter.config["url"],
+        "term":       reporter.term,
+        "user":       attributes(reporter.user),
+        "loaded_at":  reporter.loaded_at,
+        "courses":    [dump_course(c) for c in reporter.courses.values()],
+        "weightings": {gid: vars(w) for gid, w in calculator.assignment_weightings.items()},
+        "groups":     dict(calculator.assignment_groups),
+        "weighting_totals": dict(calculator.weighting_totals),
+        "score_totals":     dict(calculator.score_totals)
+    }
+
+def save(student, reporter):
+    data = HEADER.pack(MAGIC, FORMAT_VERSION) + pickle.dumps(dump(reporter), protocol=pickle.HIGHEST_PROTOCOL)
+    file_path = path(student)
+    with open(file_path + ".tmp", "wb") as out:
+        out.write(data)
+    os.replace(file_path + ".tmp", file_path)
+    reporter.saved_at = reporter.loaded_at
+    logger.info("Saved warm start for {} ({} bytes)".format(student, len(data)))
+
+def save_if_changed(student, reporter):
+    if reporter.loaded_at and reporter.saved_at != reporter.loaded_at:
+        save(student, reporter)
+
+def read(student):
+    file_path = path(student)
+    if not os.path.exists(file_path) or os.path.getsize(file_path) <= HEADER.size:
+        return None
+    with open(file_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version = HEADER.unpack_from(mapped)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                logger.info("Ignoring warm start for {}, format {}".format(student, version))
+                return None
+            with memoryview(mapped)[HEADER.size:] as view:
+                return pickle.loads(view)
+
+def restore_assignment(requester, user, course, saved):
+    raw = restore_canvas_object(CanvasAssignment, requester, saved["raw"])
+    raw.submission = restore_canvas_object(CanvasSubmission, requester, saved["submission"])
+    assignment = restore_object(Assignment, saved["state"])
+    assignment.logger = logging.getLogger(Assignment.__module__)
+    assignment.user = user
+    assignment.assignment = raw
+    assignment.submission = raw.submission
+    assignment.comment_loader = course.load_submission_comments
+    assignment._submission_comments = [restore_object(Comment, fields) for fields in saved["comments"]]
+    assignment.status = SubmissionStatus[saved["status"]]
+    return assignment
+
+def restore_course(requester, user, catalog, saved):
+    course = Course(restore_canvas_object(CanvasCourse, requester, saved["raw"]), catalog=catalog)
+    if saved["loaded_at"] is not None:
+        loaded = CourseAssignments({}, {}, {})
+        for a in saved["assignments"]:
+            assignment = restore_assignment(requester, user, course, a)
+            if assignment.is_valid:
+                loaded.valid[assignment.id] = assignment
+            else:
+                loaded.invalid[assignment.id] = assignment
+        for id in saved["candidates"]:
+            loaded.comment_candidates[id] = loaded.valid.get(id) or loaded.invalid[id]
+        course.commit(loaded)
+        course.loaded_at = saved["loaded_at"]
+        course.stale = saved["stale"]
+    return course
+
+# A Reporter rebuilt from the student's warm start file without any Canvas calls, or None
+def load(student, config, term=None):
+    start_time = time.time()
+    try:
+        state = read(student)
+    except (OSError, pickle.UnpicklingError, EOFError, struct.error) as e:
+        logger.warning("Unreadable warm start for {}: {}".format(student, e))
+        return None
+    if state is None or state["url"] != config["url"] or state["term"] != (term.replace('_', ' ') if term else None):
+        return None
+    canvas = Canvas(config["url"], config["key"])
+    requester = canvas._Canvas__requester
+    user = restore_canvas_object(CanvasUser, requester, state["user"])
+    catalog = catalogs.get(config["url"])
+    courses = {}
+    for saved in state["courses"]:
+        course = restore_course(requester, user, catalog, saved)
+        courses[course.id] = course
+    reporter = Reporter.offline(user, courses, config.get("timezone", DEFAULT_TIMEZONE))
+    reporter.connect(config, canvas)
+    reporter.term = state["term"]
+    calculator = reporter.calculator
+    calculator.assignment_weightings = {gid: AssignmentWeighting(**w) for gid, w in state["weightings"].items()}
+    calculator.assignment_groups = state["groups"]
+    calculator.weighting_totals = state["weighting_totals"]
+    calculator.score_totals = state["score_totals"]
+    reporter.loaded_at = state["loaded_at"]
+    reporter.saved_at = state["loaded_at"]
+    logger.info("Warm start for {} took {}s".format(student, time.time() - start_time))
+    return reporter
+
+# Whether the reporter has loaded, within max_age seconds, every course include selects
+def covers(reporter, include, max_age):
+    if reporter.loaded_at is None or time.time() - reporter.loaded_at > max_age:
+        return False
+    courses = [c for c in reporter.courses.values() if (c.is_valid or c.is_service) and (include is None or include(c))]
+    return all(c.loaded_at is not None for c in courses)
+
+# Warm started Reporter reconciling with Canvas in the background, or a cold one if there is
+# no usable file. on_reconciled(reporter) is called once the fresh data is in.
+def start(student, config, on_reconciled=None):
+    reporter = load(student, config)
+    if reporter is None:
+        return Reporter(config)
+    reporter.reconciling = True
+
+    def reconcile():
+        try:
+            with request_priority(Priority.Background):
+                reporter.reconcile()
+            save(student, reporter)
+            if on_reconciled:
+                on_reconciled(reporter)
+        except Exception as e:
+            reporter.reconciling = False
+            reporter.needs_reload = True
+            logger.warning("Reconciling {} failed: {}".format(student, e))
+
+    threading.Thread(target=reconcile, name="reconcile-" + student, daemon=True).start()
+    return reporter
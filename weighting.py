@@ -1,7 +1,9 @@
 from dataclasses import dataclass
 from datetime import datetime
 import logging
+import threading
 import pytz
+import tracing
 
 @dataclass
 class AssignmentWeighting:
@@ -20,39 +22,59 @@ class WeightedScoreCalculator:
         self.weighting_totals = {}
         self.score_totals = {}
         self.courses = courses
+        self.lock = threading.Lock()
         self.logger = logging.getLogger(__name__)
         self.logger.info("Weighting init")
-        for course in courses.values():
-            if course.is_valid:
-                assignment_group = []
-                groups = course.assignment_groups()
-                for g in groups:
-                    w = g.group_weight
-                    if w == 0:
-                        w = 100
-                    self.assignment_weightings[g.id] = AssignmentWeighting(course.name, g.name, w, 0, 0)
-                    assignment_group.append(g.id)
-                    self.logger.info("{}({}) {} {} {}%".format(course.name, course.id, g.name, g.id, w))
-                self.assignment_groups[course.id] = assignment_group
+
+    # Assignment groups are fetched per course the first time that course is used. The fetch
+    # runs outside the lock so courses load in parallel; if two race, the first one is kept.
+    def load_groups(self, course):
+        with self.lock:
+            if not course.is_valid or course.id in self.assignment_groups:
+                return
+        groups = course.assignment_groups()
+        with self.lock:
+            if course.id not in self.assignment_groups:
+                self.add_groups(course, groups)
+
+    # Groups a loader already has (e.g. from GraphQL), filtered by course.filter_groups
+    def set_groups(self, course, groups):
+        with self.lock:
+            if not course.is_valid or course.id in self.assignment_groups:
+                return
+            self.add_groups(course, groups)
+
+    def add_groups(self, course, groups):
+        assignment_group = []
+        for g in groups:
+            w = g.group_weight
+            if w == 0:
+                w = 100
+            self.assignment_weightings[g.id] = AssignmentWeighting(course.name, g.name, w, 0, 0)
+            assignment_group.append(g.id)
+            self.logger.info("{}({}) {} {} {}%".format(course.name, course.id, g.name, g.id, w))
+        self.assignment_groups[course.id] = assignment_group
+
+    def load_course_groups(self, course_id):
+        if course_id not in self.assignment_groups:
+            self.load_groups(self.courses[course_id])
 
     # Re-calculate weightings in case some some weights are not yet in use
     def update(self, assignments, end_date):
+        trace = tracing.active()
         for gid in self.assignment_weightings:
             self.assignment_weightings[gid].score = 0
             self.assignment_weightings[gid].max_score = 0
         course_groups = {}
 
-        self.logger.info("Weighting first pass")
         for id, assignment in assignments.items():
             course_id = assignment.course_id
             group_id = assignment.get_group()
+            self.load_course_groups(course_id)
             valid_group = group_id in self.assignment_groups[assignment.course_id]
-            self.logger.info(" {}[{}] = {} ({})".format(assignment.get_course_name(), group_id, assignment.get_name(), id))
-            self.logger.info(" - Checking assignment")
-            self.logger.info("   - valid assignment: {}".format(assignment.is_valid))
-            self.logger.info("   - valid group: {}".format(valid_group))
-            self.logger.info("   - graded: {}".format(assignment.is_graded()))
-            self.logger.info("   - score: {}".format(assignment.get_score()))
+            if trace:
+                trace.event("weighting.assignment", course=assignment.get_course_name(), group=group_id, assignment=id, name=assignment.get_name(),
+                            valid=assignment.is_valid, valid_group=valid_group, graded=assignment.is_graded(), score=assignment.get_score())
             if valid_group:
                 if not course_id in course_groups:
                     course_groups[course_id] = []
@@ -62,29 +84,28 @@ class WeightedScoreCalculator:
                 if assignment.is_graded():
                     self.assignment_weightings[group_id].max_score += assignment.get_points_possible()
                     self.assignment_weightings[group_id].score += assignment.get_raw_score()
-                    self.logger.info("   - group score: {}/{}".format(self.assignment_weightings[group_id].score, self.assignment_weightings[group_id].max_score))
 
-        self.logger.info("Weighting second pass")
         for course_id in course_groups:
             groups = course_groups[course_id]
-            self.logger.info("course_groups[{}] = {}".format(course_id, groups))
             if len(groups) == 1:
                 self.assignment_weightings[groups[0]].weighting = 100
             total_weighting = 0
             total_score = 0
             for gid in groups:
-                self.logger.info("- {} {}".format(self.assignment_weightings[gid].course, self.assignment_weightings[gid].name))
-                self.logger.info("   - score: {}".format(self.assignment_weightings[gid].score))
-                self.logger.info("   - max score: {}".format(self.assignment_weightings[gid].max_score))
-                self.logger.info("   - weighting: {}".format(self.assignment_weightings[gid].weighting))
-                total_weighting += self.assignment_weightings[gid].weighting
-                if self.assignment_weightings[gid].max_score > 0:
-                    total_score +=  self.assignment_weightings[gid].weighting * 100 * self.assignment_weightings[gid].score / self.assignment_weightings[gid].max_score
+                weighting = self.assignment_weightings[gid]
+                if trace:
+                    trace.event("weighting.group", course=weighting.course, group=gid, name=weighting.name,
+                                score=weighting.score, max_score=weighting.max_score, weighting=weighting.weighting)
+                total_weighting += weighting.weighting
+                if weighting.max_score > 0:
+                    total_score +=  weighting.weighting * 100 * weighting.score / weighting.max_score
             self.weighting_totals[course_id] = total_weighting
             self.score_totals[course_id] = total_score
-            self.logger.info("{}: total_score={}".format(course_id, self.score_totals[course_id]/self.weighting_totals[course_id]))
+            if trace:
+                trace.event("weighting.course", course=course_id, groups=groups, total_weighting=total_weighting, total_score=total_score / total_weighting if total_weighting else None)
 
     def includes_assignment(self, assignment):
+        self.load_course_groups(assignment.course_id)
         group_id = assignment.get_group()
         return group_id in self.assignment_weightings
 
@@ -98,50 +119,46 @@ class WeightedScoreCalculator:
                 possible_gain = self.weighted_gain(assignment)
         else:
             self.logger.warn("Assignment group not known {}[{}] = {}".format(assignment.get_course_name(), gid, assignment.get_name()))
-        self.logger.info("   - possible gain: {}".format(possible_gain))
         return possible_gain
 
     def unweighted_gain(self, assignment):
         max_score = 0
-        self.logger.info(" - Calculating unweighted gain: {}".format(assignment.get_name()))
         groups = self.assignment_groups[assignment.course_id]
         for group in groups:
             max_score += self.assignment_weightings[group].max_score
-            self.logger.info(" - {} {}".format(self.assignment_weightings[group].max_score, max_score))
-        self.logger.info(" - calculation {}/{}".format(assignment.get_points_dropped(), max_score))
-        if max_score > 0:
-            return round(100*assignment.get_points_dropped()/max_score)
-        else:
-            return 0
+        possible_gain = round(100*assignment.get_points_dropped()/max_score) if max_score > 0 else 0
+        trace = tracing.active()
+        if trace:
+            trace.event("gain.unweighted", course=assignment.get_course_name(), assignment=assignment.id, name=assignment.get_name(),
+                        points_dropped=assignment.get_points_dropped(), course_max_score=max_score, gain=possible_gain)
+        return possible_gain
 
     def weighted_gain(self, assignment):
         gid = assignment.group
         possible_gain = 0
-        self.logger.info(" {}[{}] = {}".format(assignment.get_course_name(), gid, assignment.get_name()))
-        self.logger.info(" - Calculating weighted gain")
         course_id = assignment.course_id
         score = self.assignment_weightings[gid].score
         max_score = self.assignment_weightings[gid].max_score
         weighting = self.assignment_weightings[gid].weighting
         weighting_total = self.weighting_totals[course_id]
-        self.logger.info("   - graded: {}".format(assignment.is_graded()))
-        self.logger.info("   - group score: {}".format(score))
-        self.logger.info("   - group max score: {}".format(max_score))
-        self.logger.info("   - group weighting: {}".format(weighting))
-        self.logger.info("   - group weighting total: {}".format(weighting_total))
-        self.logger.info("   - assignment points possible: {}".format(assignment.get_points_possible()))
         if assignment.is_graded():
-            self.logger.info("   - assignment points dropped: {}".format(assignment.get_points_dropped()))
             dropped = (100 * assignment.get_points_dropped()) / max_score
             possible_gain = weighting * dropped / weighting_total
+            method = "graded"
         elif max_score > 0:
             current_pct = (100 * (score)) / (max_score)
             new_pct = (100 * (score + assignment.get_points_possible())) / (max_score + assignment.get_points_possible())
             possible_gain = ((new_pct - current_pct) * weighting) / weighting_total
+            method = "ungraded"
         else:
-            self.logger.info("   - assignment group has no entries")
             current_score = self.score_totals[course_id]/weighting_total
             weighting_total = weighting_total + weighting
             new_score = (self.score_totals[course_id] + weighting * 100) / weighting_total
             possible_gain = new_score - current_score
+            method = "empty group"
+        trace = tracing.active()
+        if trace:
+            trace.event("gain.weighted", course=assignment.get_course_name(), group=gid, assignment=assignment.id, name=assignment.get_name(), method=method,
+                        group_score=score, group_max_score=max_score, group_weighting=weighting, weighting_total=self.weighting_totals[course_id],
+                        points_possible=assignment.get_points_possible(), points_dropped=assignment.get_points_dropped(), gain=possible_gain)
         return round(possible_gain)